@@ -0,0 +1,222 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time as t
+import timeit
+import numpy as np
+from intervalsProbability import *
+
+def syntheticIntervals(m,n,conflict,rng,s=4,maxCount=15):
+    """Generate m probability intervals over n classes, as obtained by the imprecise Dirichlet model
+    from class counts drawn around a common distribution
+
+    Argument:
+    m -- number of probability intervals (sources)
+    n -- number of classes
+    conflict -- value in [0,1], 0 when all sources draw counts from the same distribution, 1 when
+                each source draws them from its own distribution
+    rng -- a numpy RandomState
+    s -- parameter of the imprecise Dirichlet model
+    maxCount -- maximal number of counts of a source
+
+    Return a mx2xn array containing upper (1st row) and lower (2nd row) bounds.
+    """
+    if conflict < 0 or conflict > 1:
+        raise Exception('Conflict level should be in [0,1]')
+    base=rng.dirichlet(np.ones(n))
+    intlist=np.zeros((m,2,n))
+    for i in range(m):
+        distribution=(1-conflict)*base+conflict*rng.dirichlet(np.ones(n))
+        counts=rng.multinomial(rng.randint(1,maxCount+1),distribution/distribution.sum()).astype(float)
+        divide=counts.sum()+s
+        intlist[i,1,:]=counts/divide
+        intlist[i,0,:]=(counts+s)/divide
+    return intlist
+
+def syntheticSet(m,n,conflict,seed=0):
+    """Return a setOfIntProba of m synthetic probability intervals (see syntheticIntervals)
+    """
+    return setOfIntProba(syntheticIntervals(m,n,conflict,np.random.RandomState(seed)))
+
+def _combinationBenchmark(combname):
+    return lambda intlist: setOfIntProba(intlist.copy()).runCombination(combname)
+
+def compatibleIntervals(intlist):
+    """Return the bounds of the largest 'almost' MCS of a mx2xn array, discounted if they are not
+    compatible, so that their conjunction is non-empty
+    """
+    largest=setOfIntProba(intlist[np.flatnonzero(setOfIntProba(intlist).getLargestMCS(1)[0][0])])
+    if largest.areCompatible() == 0:
+        largest.discountnoncomp()
+    return largest.getIntervals()
+
+# benchmarked functions, taking a mx2xn array of probability intervals (copied when they are modified)
+BENCHMARKS=[
+    ("getMaxCoherentIntervals",lambda intlist: [getMaxCoherentIntervals(intlist[:,:,j].transpose())
+                                                for j in range(intlist.shape[2])]),
+    ("getalmostMCS",lambda intlist: setOfIntProba(intlist).getalmostMCS()),
+    ("getLargestMCS",lambda intlist: setOfIntProba(intlist).getLargestMCS(5)),
+    ("almostMCScomb",_combinationBenchmark("almostMCScomb")),
+    ("mostMCSconj",_combinationBenchmark("mostMCSconj")),
+    ("bestfirstMCS",_combinationBenchmark("bestfirstMCS")),
+    ("meanfirstMCSweighted",_combinationBenchmark("meanfirstMCSweighted")),
+    ("runCombinations",lambda intlist: setOfIntProba(intlist.copy()).runCombinations(
+        ["almostMCScomb","mostMCSconj","bestfirstMCS","meanfirstMCSweighted"])),
+    ("conjunction",lambda intlist: setOfIntProba(intlist).conjunction()),
+    ("disjunction",lambda intlist: setOfIntProba(intlist).disjunction()),
+    ("setReachableProbability",lambda intlist: [intervalsProbability(intlist[i].copy()).setReachableProbability()
+                                                for i in range(intlist.shape[0])]),
+    ("batchSetReachableProbability",lambda intlist: batchIntervalsProbability(intlist.copy()).setReachableProbability()),
+    ("nc_hurwicz_decision",lambda intlist: [intervalsProbability(intlist[i]).nc_hurwicz_decision(0.5)
+                                            for i in range(intlist.shape[0])]),
+    ("nc_maximal_decision",lambda intlist: [intervalsProbability(intlist[i]).nc_maximal_decision()
+                                            for i in range(intlist.shape[0])]),
+    ("batch_nc_hurwicz_decision",lambda intlist: batchIntervalsProbability(intlist.copy()).nc_hurwicz_decision(0.5)),
+    ("batch_nc_maximal_decision",lambda intlist: batchIntervalsProbability(intlist.copy()).nc_maximal_decision()),
+    ("maximal_decision",lambda intlist: intervalsProbability(intlist[0].copy()).maximal_decision(
+        1.-np.eye(intlist.shape[2]))),
+]
+
+# functions preparing (untimed) the array given to some benchmarked functions
+SETUPS={"conjunction":compatibleIntervals}
+
+# modules importable with numpy only, and the time allowed to import them in a fresh interpreter (seconds)
+IMPORT_BUDGET={"intervalsProbability":0.5,"fusionCache":0.5,"fusionStats":0.5,"parallelFusion":0.5,
+               "sparseIntervals":0.5}
+
+def timeImport(module,repeat=5):
+    """Time the import of a module (including its dependencies) in repeat fresh interpreters
+
+    Return a tuple (best, mean, orange) of the import times, in seconds, and of whether importing
+    the module also imported Orange.
+    """
+    code="import sys,timeit; start=timeit.default_timer(); import %s; " % module
+    code+="print(timeit.default_timer()-start); print('Orange' in sys.modules)"
+    times=[]
+    for r in range(repeat):
+        output=subprocess.check_output([sys.executable,"-c",code],cwd=os.path.dirname(os.path.abspath(__file__)))
+        elapsed,orange=output.split()
+        times.append(float(elapsed))
+    return min(times),sum(times)/len(times),orange == b"True"
+
+def runImportBenchmarks(budget=IMPORT_BUDGET,repeat=5,verbose=False):
+    """Time the import of the modules of budget (a dictionary giving the time allowed to each module)
+
+    Return the list of records (dictionaries) of each module, with an over key set to True if its
+    best import time exceeds its budget or if it imports Orange.
+    """
+    records=[]
+    for module in sorted(budget):
+        best,mean,orange=timeImport(module,repeat)
+        records.append({"benchmark":"import "+module,"m":0,"n":0,"conflict":0.,"best":best,"mean":mean,
+                        "repeat":repeat,"budget":budget[module],"orange":orange,
+                        "over":orange or best > budget[module]})
+        if verbose:
+            print("%-30s best=%.6fs budget=%.2fs%s" % ("import "+module,best,budget[module],
+                                                       " (imports Orange)" if orange else ""))
+    return records
+
+def timeBenchmark(function,intlist,repeat=5):
+    """Time function on intlist repeat times (after a warm-up call)
+
+    Return a tuple (best, mean) of the execution times, in seconds.
+    """
+    function(intlist)
+    times=[]
+    for r in range(repeat):
+        start=timeit.default_timer()
+        function(intlist)
+        times.append(timeit.default_timer()-start)
+    return min(times),sum(times)/len(times)
+
+def runBenchmarks(sizes=[5, 10, 20, 50],classes=[3, 6, 10],conflicts=[0., 0.5, 1.],names=None,
+                  repeat=5,seed=0,verbose=False):
+    """Time the benchmarked functions over a grid of synthetic sets of probability intervals
+
+    Argument:
+    sizes -- numbers m of probability intervals
+    classes -- numbers n of classes
+    conflicts -- conflict levels (see syntheticIntervals)
+    names -- names of the benchmarked functions to run (default: all those of BENCHMARKS)
+    repeat -- number of timed calls of each function
+    seed -- seed of the generated sets, so that the same sets are timed from one run to another
+
+    Return the list of records (dictionaries) of each function and grid point.
+    """
+    benchmarks=[(name,function) for name,function in BENCHMARKS if names is None or name in names]
+    if names is not None and len(benchmarks) < len(names):
+        raise Exception('Unknown benchmarks: %s' % ", ".join(set(names)-set([name for name,f in benchmarks])))
+    records=[]
+    for m in sizes:
+        for n in classes:
+            for conflict in conflicts:
+                intlist=syntheticIntervals(m,n,conflict,np.random.RandomState(seed))
+                nbMCS=len(setOfIntProba(intlist).getMCSMasks())
+                for name,function in benchmarks:
+                    best,mean=timeBenchmark(function,SETUPS.get(name,lambda intlist: intlist)(intlist),repeat)
+                    records.append({"benchmark":name,"m":m,"n":n,"conflict":conflict,"nbMCS":nbMCS,
+                                    "best":best,"mean":mean,"repeat":repeat})
+                    if verbose:
+                        print("%-30s m=%-4d n=%-3d conflict=%.2f best=%.6fs" % (name,m,n,conflict,best))
+    return records
+
+def saveBenchmarks(records,filename):
+    """Save benchmark records in a JSON file, together with the versions they were obtained with
+    """
+    output={"time":t.strftime("%Y-%m-%d %H:%M:%S"),"python":platform.python_version(),
+            "numpy":np.__version__,"platform":platform.platform(),"records":records}
+    with open(filename,"w") as benchfile:
+        json.dump(output,benchfile,indent=1,sort_keys=True)
+
+def loadBenchmarks(filename):
+    """Return the benchmark records saved in a JSON file
+    """
+    with open(filename) as benchfile:
+        return json.load(benchfile)["records"]
+
+def compareBenchmarks(reference,records,threshold=1.2):
+    """Compare benchmark records with reference ones, matched by function and grid point
+
+    Return the list of tuples (benchmark, m, n, conflict, ratio) whose best time ratio (new/reference)
+    exceeds threshold, the largest ratios first.
+    """
+    def key(record):
+        return (record["benchmark"],record["m"],record["n"],record["conflict"])
+    referencetimes=dict((key(record),record["best"]) for record in reference)
+    slower=[]
+    for record in records:
+        if key(record) in referencetimes and referencetimes[key(record)] > 0:
+            ratio=record["best"]/referencetimes[key(record)]
+            if ratio > threshold:
+                slower.append(key(record)+(ratio,))
+    return sorted(slower,key=lambda regression: -regression[4])
+
+if __name__=='__main__':
+    import argparse
+    parser=argparse.ArgumentParser(description="Benchmarks of probability intervals on synthetic data")
+    parser.add_argument("--sizes",type=int,nargs="+",default=[5, 10, 20, 50])
+    parser.add_argument("--classes",type=int,nargs="+",default=[3, 6, 10])
+    parser.add_argument("--conflicts",type=float,nargs="+",default=[0., 0.5, 1.])
+    parser.add_argument("--benchmarks",nargs="+",default=None)
+    parser.add_argument("--repeat",type=int,default=5)
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--output",default="benchmarks.json")
+    parser.add_argument("--compare",default=None,help="JSON file of reference records")
+    parser.add_argument("--threshold",type=float,default=1.2)
+    parser.add_argument("--no-imports",action="store_true",help="do not time module imports")
+    args=parser.parse_args()
+    records=[]
+    if not args.no_imports:
+        records=runImportBenchmarks(repeat=args.repeat,verbose=True)
+    records+=runBenchmarks(args.sizes,args.classes,args.conflicts,args.benchmarks,args.repeat,args.seed,verbose=True)
+    saveBenchmarks(records,args.output)
+    if args.compare is not None:
+        for benchmark,m,n,conflict,ratio in compareBenchmarks(loadBenchmarks(args.compare),records,args.threshold):
+            print("slower: %-30s m=%-4d n=%-3d conflict=%.2f x%.2f" % (benchmark,m,n,conflict,ratio))
+    print("records saved in %s" % args.output)
+    overbudget=[record["benchmark"] for record in records if record.get("over",False)]
+    if len(overbudget) > 0:
+        print("over import budget: %s" % ", ".join(overbudget))
+        sys.exit(1)
@@ -0,0 +1,393 @@
+import os
+import sys
+import tempfile
+import timeit
+import numpy as np
+from intervalsProbability import *
+from sparseIntervals import sparseIntervalsFromDense, sparseSetOfIntProba
+from parallelFusion import COMBINATIONS
+from benchmarks import syntheticIntervals
+
+# bounds computed in different orders may differ by summation roundoff
+TOLERANCE=1e-9
+
+def _close(bounds1,bounds2):
+    return np.allclose(bounds1,bounds2,rtol=0,atol=TOLERANCE)
+
+def referenceMaxCoherentIntervals(setOfInt):
+    """Original (sweep by loops) version of getMaxCoherentIntervals, which may also return non
+    maximal subsets when bounds are equal
+    """
+    upper=setOfInt[0,:]
+    lower=setOfInt[1,:]
+    indup=upper.argsort()
+    indlow=lower.argsort()
+    sortup=np.sort(upper)
+    sortlow=np.sort(lower)
+    MCSlist=[]
+    currentMCS=[]
+    ind_up=0
+    ind_low=0
+    for i in range(2*upper.size-1):
+        if sortup[ind_up] == sortlow[ind_low]:
+            currentMCS.append(indlow[ind_low])
+            ind_low=ind_low+1
+            if ind_low == upper.size:
+                MCSlist.append(currentMCS[:])
+                break
+            MCSlist.append(currentMCS[:])
+        elif sortlow[ind_low] < sortup[ind_up]:
+            currentMCS.append(indlow[ind_low])
+            ind_low=ind_low+1
+            if ind_low == upper.size:
+                MCSlist.append(currentMCS[:])
+                break
+            if min(sortlow[ind_low],sortup[ind_up]) < sortlow[ind_low]:
+                MCSlist.append(currentMCS[:])
+        else:
+            currentMCS.remove(indup[ind_up])
+            ind_up=ind_up+1
+    return MCSlist
+
+def _referenceCompatible(intlist):
+    low=intlist[:,1,:].max(axis=0)
+    up=intlist[:,0,:].min(axis=0)
+    if low.sum() >= 1 or up.sum() <= 1 or np.any(low >= up):
+        return 0
+    return 1
+
+def _referenceConjunction(intlist):
+    """Original conjunction of a set of probability intervals, discounted if they are not compatible
+    """
+    intlist=intlist.copy()
+    nbDecision=intlist.shape[2]
+    if _referenceCompatible(intlist) == 0:
+        low=intlist[:,1,:].max(axis=0)
+        up=intlist[:,0,:].min(axis=0)
+        epsilon_l=1.
+        epsilon_u=1.
+        if low.sum() - 1 > 0:
+            epsilon_l=1./low.sum()
+        if up.sum() - 1 < 0:
+            epsilon_u=(1.-nbDecision)/(up.sum()-nbDecision)
+        discount=min(epsilon_l,epsilon_u)*0.99
+        intlist[:,1,:]=intlist[:,1,:]*discount
+        intlist[:,0,:]=intlist[:,0,:]*discount+(1-discount)
+        if _referenceCompatible(intlist) == 0:
+            raise Exception('Probability intervals not compatible, conjunction empty')
+    fusedproba=np.zeros((2,nbDecision))
+    for i in range(nbDecision):
+        others=np.arange(nbDecision) != i
+        fusedproba[1,i]=max(intlist[:,1,i].max(),1-intlist[:,0,others].min(axis=0).sum())
+        fusedproba[0,i]=min(intlist[:,0,i].min(),1-intlist[:,1,others].max(axis=0).sum())
+    return fusedproba
+
+def referenceAlmostMCS(intlist):
+    """Original 'almost' MCS of a mx2xn array: sets are split element by element without removing
+    the sets included in other ones, duplicates being removed at the end
+
+    Return the list of lists of indices of the probability intervals in each 'almost' MCS.
+    """
+    listofMCS=[range(intlist.shape[0])]
+    for j in range(intlist.shape[2]):
+        temp_list=[]
+        for MCS in listofMCS:
+            if _referenceCompatible(intlist[MCS]) == 1:
+                temp_list.append(MCS[:])
+            else:
+                for sub_MCS in referenceMaxCoherentIntervals(intlist[MCS,:,j].transpose()):
+                    temp_list.append([MCS[k] for k in sub_MCS])
+        listofMCS=temp_list
+    unique=[]
+    for MCS in listofMCS:
+        if MCS not in unique:
+            unique.append(MCS)
+    return unique
+
+def referenceCombinations(intlist,listofMCS,n=5,stable=False):
+    """Original combinations of a mx2xn array given its 'almost' MCS (see referenceAlmostMCS)
+
+    Argument:
+    stable -- if False, the largest MCS are ranked as originally (argsort of sizes, reversed, which
+              leaves ties in no defined order), else by decreasing size and in the order of listofMCS
+
+    Return a dictionary giving the 2xn array of fused bounds of each combination.
+    """
+    sizes=np.array([len(MCS) for MCS in listofMCS])
+    if stable:
+        best=np.argsort(-sizes,kind='mergesort')
+    else:
+        best=np.argsort(sizes)[::-1]
+    nb=min(n,sizes.size)
+    conj=[_referenceConjunction(intlist[MCS]) for MCS in listofMCS]
+    results={}
+    results["almostMCScomb"]=np.array([np.max(conj,axis=0)[0],np.min(conj,axis=0)[1]])
+    results["mostMCSconj"]=conj[sizes.argmax()]
+    firsts=np.array([conj[i] for i in best[:nb]])
+    results["bestfirstMCS"]=np.array([firsts[:,0,:].max(axis=0),firsts[:,1,:].min(axis=0)])
+    weights=sizes[best[:nb]]/float(sizes[best[:nb]].sum())
+    results["meanfirstMCSweighted"]=(weights[:,np.newaxis,np.newaxis]*firsts).sum(axis=0)
+    return results
+
+def maximalSets(listofMCS):
+    """Return the sets of listofMCS that are included in no other one (duplicates once), as sorted
+    lists, by decreasing size and then in lexicographic order (see maskOrder)
+    """
+    sets=set([frozenset(MCS) for MCS in listofMCS])
+    kept=[sorted(MCS) for MCS in sets if not any([MCS < other for other in sets])]
+    return sorted(kept,key=lambda MCS: (-len(MCS),MCS))
+
+def _randomStacks(rng,nb,maxSources=30,maxClasses=6):
+    for k in range(nb):
+        yield syntheticIntervals(rng.randint(1,maxSources+1),rng.randint(2,maxClasses+1),rng.rand(),rng)
+
+def checkMCS(nb=300,seed=0):
+    """Compare the 'almost' MCS and combinations of setOfIntProba with the original ones on random stacks
+
+    By default, the 'almost' MCS (in order) and the combinations should be the original ones, and
+    the number of stacks whose results differ from the original ones is reported for each
+    combination (mostMCSconj being also computed alone). The largest MCS of getLargestMCS should be the first ones of the MCS sorted by
+    decreasing size. With maximal, the MCS should be the maximal original MCS, and the combinations
+    those of these MCS in mask order.
+
+    Return a dictionary of counts (the mismatch and differs ones should be 0).
+    """
+    rng=np.random.RandomState(seed)
+    counts={"stacks":0,"subsumed":0,"mcs mismatch":0,"largest mismatch":0,"maximal mcs mismatch":0}
+    for combname in COMBINATIONS:
+        counts[combname+" differs from original"]=0
+        counts[combname+" maximal mismatch"]=0
+    for intlist in _randomStacks(rng,nb):
+        counts["stacks"]+=1
+        original=referenceAlmostMCS(intlist)
+        current=setOfIntProba(intlist)
+        if current.getalmostMCS() != original:
+            counts["mcs mismatch"]+=1
+        else:
+            results=current.runCombinations(COMBINATIONS)
+            originals=referenceCombinations(intlist,original)
+            # alone, mostMCSconj only searches the largest MCS
+            results["mostMCSconj"]=setOfIntProba(intlist).mostMCSconj()
+            for combname in COMBINATIONS:
+                if not _close(results[combname].lproba,originals[combname]):
+                    counts[combname+" differs from original"]+=1
+            bysize=sorted(original,key=len,reverse=True)
+            for nblargest in range(1,7):
+                masks,sizes=setOfIntProba(intlist).getLargestMCS(nblargest)
+                largest=[list(np.flatnonzero(mask)) for mask in masks]
+                if largest != [sorted(MCS) for MCS in bysize[:nblargest]] or list(sizes) != map(len,bysize[:nblargest]):
+                    counts["largest mismatch"]+=1
+                    break
+        maximal=maximalSets(original)
+        if len(maximal) < len(original):
+            counts["subsumed"]+=1
+        current=setOfIntProba(intlist,maximal=True)
+        if sorted(current.getalmostMCS(),key=lambda MCS: (-len(MCS),MCS)) != maximal:
+            counts["maximal mcs mismatch"]+=1
+            continue
+        results=current.runCombinations(COMBINATIONS)
+        expected=referenceCombinations(intlist,maximal,stable=True)
+        for combname in COMBINATIONS:
+            if not _close(results[combname].lproba,expected[combname]):
+                counts[combname+" maximal mismatch"]+=1
+    return counts
+
+def compareSizes(m=100,n=5,conflict=0.5,seed=1):
+    """Return the numbers of original and maximal 'almost' MCS of a synthetic stack, and the times
+    taken to compute them (seconds) by the original code, by setOfIntProba and by setOfIntProba
+    with maximal
+    """
+    intlist=syntheticIntervals(m,n,conflict,np.random.RandomState(seed))
+    start=timeit.default_timer()
+    original=referenceAlmostMCS(intlist)
+    originaltime=timeit.default_timer()-start
+    start=timeit.default_timer()
+    setOfIntProba(intlist).getalmostMCS()
+    currenttime=timeit.default_timer()-start
+    start=timeit.default_timer()
+    maximal=setOfIntProba(intlist,maximal=True).getalmostMCS()
+    maximaltime=timeit.default_timer()-start
+    return len(original),len(maximal),originaltime,currenttime,maximaltime
+
+def checkMemmap(nb=300,seed=0):
+    """Compare the combinations (and discounting) of memory-mapped stacks read by chunks with
+    those of the same stacks in memory, and check that the files are not modified
+
+    Return a dictionary of counts (the mismatch ones should be 0).
+    """
+    rng=np.random.RandomState(seed)
+    counts={"stacks":0,"mismatch":0,"file modified":0}
+    directory=tempfile.mkdtemp()
+    filename=os.path.join(directory,"stack.npy")
+    try:
+        for intlist in _randomStacks(rng,nb,maxSources=40,maxClasses=8):
+            counts["stacks"]+=1
+            np.save(filename,intlist)
+            mapped=memmapSetOfIntProba(filename,chunksize=rng.randint(1,5))
+            inmemory=setOfIntProba(intlist.copy())
+            results=inmemory.runCombinations(COMBINATIONS)
+            mappedresults=mapped.runCombinations(COMBINATIONS)
+            same=mapped.getalmostMCS() == inmemory.getalmostMCS()
+            same&=all([np.array_equal(results[combname].lproba,mappedresults[combname].lproba)
+                       for combname in COMBINATIONS])
+            inmemory.discountnoncomp()
+            mapped.discountnoncomp()
+            same&=np.array_equal(inmemory.getIntervals(),mapped.getIntervals())
+            same&=np.array_equal(inmemory.disjunction().lproba,mapped.disjunction().lproba)
+            if not same:
+                counts["mismatch"]+=1
+            del mapped
+            if not np.array_equal(np.load(filename),intlist):
+                counts["file modified"]+=1
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rmdir(directory)
+    return counts
+
+def checkIncremental(nbSequences=30,nbSteps=80,seed=0):
+    """Compare the 'almost' MCS and combinations of incrementalSetOfIntProba, after each random
+    addition or removal of a source, with those of setOfIntProba on the current sources
+
+    Return a dictionary of counts (the mismatch ones should be 0).
+    """
+    rng=np.random.RandomState(seed)
+    counts={"states":0,"ties":0,"mcs mismatch":0,"combination mismatch":0}
+    for sequence in range(nbSequences):
+        nbDecision=rng.randint(2,7)
+        pool=syntheticIntervals(200,nbDecision,rng.rand(),rng)
+        incremental=incrementalSetOfIntProba(nbDecision)
+        for step in range(nbSteps):
+            if len(incremental) > 1 and rng.rand() < 0.4:
+                incremental.remove(incremental.sources[rng.randint(len(incremental))])
+            else:
+                incremental.add(pool[rng.randint(pool.shape[0])])
+            counts["states"]+=1
+            full=incremental.getSetOfIntProba()
+            expected=[[incremental.sources[i] for i in MCS] for MCS in full.getalmostMCS()]
+            sizes=sorted([len(MCS) for MCS in expected])[::-1]
+            if len(sizes) > 1 and sizes[0] == sizes[1]:
+                counts["ties"]+=1
+            if incremental.getalmostMCS() != expected:
+                counts["mcs mismatch"]+=1
+            results=full.runCombinations(COMBINATIONS)
+            incrementalresults=incremental.runCombinations(COMBINATIONS)
+            if not all([np.array_equal(results[combname].lproba,incrementalresults[combname].lproba)
+                        for combname in COMBINATIONS]):
+                counts["combination mismatch"]+=1
+    return counts
+
+def checkSparse(nb=300,seed=0):
+    """Compare the 'almost' MCS and combinations of sparseSetOfIntProba with those of the dense
+    stacks (by default and with maximal), on random sources having bounds on a few of many classes
+
+    Return a dictionary of counts (the mismatch ones should be 0).
+    """
+    rng=np.random.RandomState(seed)
+    counts={"sets":0,"mcs mismatch":0,"combination mismatch":0,"maximal mcs mismatch":0,"maximal combination mismatch":0}
+    for k in range(nb):
+        nbDecision=rng.randint(2,40)
+        nbSources=rng.randint(1,20)
+        intlist=np.zeros((nbSources,2,nbDecision))
+        for i in range(nbSources):
+            # counts on a few classes, the others sharing the default bounds of the imprecise Dirichlet model
+            support=rng.choice(nbDecision,rng.randint(1,min(nbDecision,6)+1),replace=False)
+            sourcecounts=np.zeros(nbDecision)
+            sourcecounts[support]=rng.randint(1,15,support.size)
+            divide=sourcecounts.sum()+4
+            intlist[i,1,:]=sourcecounts/divide
+            intlist[i,0,:]=(sourcecounts+4)/divide
+        counts["sets"]+=1
+        for maximal in [False,True]:
+            prefix="maximal " if maximal else ""
+            sparse=sparseSetOfIntProba([sparseIntervalsFromDense(intlist[i]) for i in range(nbSources)],maximal=maximal)
+            dense=setOfIntProba(intlist,maximal=maximal)
+            if sparse.getalmostMCS() != dense.getalmostMCS():
+                counts[prefix+"mcs mismatch"]+=1
+                continue
+            try:
+                results=dense.runCombinations(COMBINATIONS)
+            except Exception:
+                results=None
+            try:
+                sparseresults=sparse.runCombinations(COMBINATIONS)
+            except Exception:
+                sparseresults=None
+            if results is None or sparseresults is None:
+                if (results is None) != (sparseresults is None):
+                    counts[prefix+"combination mismatch"]+=1
+                continue
+            if not all([_close(sparseresults[combname].toDense(),results[combname].lproba)
+                        for combname in COMBINATIONS]):
+                counts[prefix+"combination mismatch"]+=1
+    return counts
+
+def checkEvents(nb=300,seed=0):
+    """Compare the probabilities of events given as integer bitmasks of various dtypes with those
+    of the same events given as 0/1 matrices, and check that bitmasks outside the frame are rejected
+
+    Return a dictionary of counts (the mismatch ones should be 0).
+    """
+    rng=np.random.RandomState(seed)
+    counts={"frames":0,"mismatch":0,"rejection mismatch":0}
+    dtypes=[np.uint8,np.int16,np.int32,np.uint32,np.int64,np.uint64]
+    for k in range(nb):
+        nbDecision=rng.randint(2,64)
+        intprob=intervalsProbability(syntheticIntervals(1,nbDecision,0.,rng)[0])
+        counts["frames"]+=1
+        matrix=rng.randint(0,2,(10,nbDecision))
+        # bits of the events, the last elements being left out of some of them
+        matrix[:5,rng.randint(1,nbDecision+1):]=0
+        expected=intprob.getEventsProbability(matrix)
+        for dtype in dtypes:
+            masks=[sum([2**i for i in range(nbDecision) if event[i]]) for event in matrix]
+            kept=[i for i in range(len(masks)) if masks[i] <= np.iinfo(dtype).max]
+            if not kept:
+                continue
+            events=np.array([masks[i] for i in kept],dtype=dtype)
+            if not _close(intprob.getEventsProbability(events),expected[:,kept]):
+                counts["mismatch"]+=1
+        # bitmasks using a bit beyond the frame, or negative
+        for dtype in dtypes:
+            info=np.iinfo(dtype)
+            outside=[value for value in [2**nbDecision,2**nbDecision+1,info.max,info.min,-1]
+                     if info.min <= value <= info.max and (value < 0 or value >= 2**nbDecision)]
+            for value in outside:
+                try:
+                    intprob.getEventsProbability(np.array([value],dtype=dtype))
+                    counts["rejection mismatch"]+=1
+                except Exception:
+                    pass
+    return counts
+
+if __name__=='__main__':
+    import argparse
+    parser=argparse.ArgumentParser(description="Randomized checks of the fusion code against reference implementations")
+    parser.add_argument("--checks",nargs="+",default=["mcs","sizes","memmap","incremental","sparse","events"])
+    parser.add_argument("--trials",type=int,default=300)
+    parser.add_argument("--seed",type=int,default=0)
+    args=parser.parse_args()
+    failed=False
+    for check in args.checks:
+        if check == "sizes":
+            nboriginal,nbmaximal,originaltime,currenttime,maximaltime=compareSizes()
+            print("sizes: 100 sources, 5 classes: %d original sets (%.2fs, %.2fs now), %d maximal ones (%.2fs)"
+                  % (nboriginal,originaltime,currenttime,nbmaximal,maximaltime))
+            continue
+        if check == "mcs":
+            counts=checkMCS(args.trials,args.seed)
+        elif check == "memmap":
+            counts=checkMemmap(args.trials,args.seed)
+        elif check == "incremental":
+            counts=checkIncremental(max(1,args.trials//10),80,args.seed)
+        elif check == "sparse":
+            counts=checkSparse(args.trials,args.seed)
+        elif check == "events":
+            counts=checkEvents(args.trials,args.seed)
+        else:
+            raise Exception('Unknown check: %s' % check)
+        print("%s: %s" % (check,", ".join(["%s=%d" % (key,counts[key]) for key in sorted(counts)])))
+        failed|=any([counts[key] > 0 for key in counts if "mismatch" in key or "modified" in key or "differs" in key])
+    if failed:
+        print("some checks failed")
+        sys.exit(1)
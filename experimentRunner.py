@@ -0,0 +1,229 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import time as t
+import numpy as np
+import Orange
+from methodTree import test_simpleTree
+from orangeForest import forestIntervals, trainForest, trueClasses
+from parallelFusion import COMBINATIONS, fuseLeaves, fusionAccuracies
+from fusionCache import fusionCache
+
+METHODS=COMBINATIONS+["forestVote","simpleTree"]
+
+def datasetId(dataset):
+    """Return the identifier of a dataset: its absolute path if it is a file, its name otherwise
+    (e.g. for the datasets found by Orange)
+    """
+    if os.path.isfile(dataset):
+        return os.path.abspath(dataset)
+    return dataset
+
+def cellKey(result):
+    """Return the key (datasetId, seed, nbFolds, fold, nbTree, method) identifying the cell of a result
+    (results written without datasetId, seed or nbFolds match no cell)
+    """
+    return (result.get("datasetId"),result.get("seed"),result.get("nbFolds"),result["fold"],result["nbTree"],
+            result["method"])
+
+def loadResults(filename):
+    """Read the results already written in a JSON lines file (an interrupted last line is ignored)
+    """
+    results=[]
+    if not os.path.exists(filename):
+        return results
+    with open(filename) as resultfile:
+        for line in resultfile:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                pass
+    return results
+
+def _endsWithNewline(filename):
+    with open(filename,"rb") as resultfile:
+        resultfile.seek(-1,os.SEEK_END)
+        return resultfile.read(1) == b"\n"
+
+def _cachePath(cachedir,kind,task,extension):
+    # the basename is kept for readability, the hash of the identifier tells datasets apart
+    digest=hashlib.md5(task["datasetId"].encode("utf-8")).hexdigest()[:10]
+    name="%s_%s_%s_seed%d_%dfolds_fold%d_%dtrees.%s" % (kind,os.path.basename(task["dataset"]),digest,task["seed"],
+                                                      task["nbFolds"],task["fold"],task["nbTree"],extension)
+    return os.path.join(cachedir,name)
+
+def _atomicDump(obj,filename,dump):
+    # files are written under a temporary name, so that an interrupted write leaves no corrupted cache
+    with open(filename+".tmp","wb") as cachefile:
+        dump(obj,cachefile)
+    os.rename(filename+".tmp",filename)
+
+def _split(dataset,fold,nbFolds,seed):
+    data=Orange.data.Table(dataset)
+    indices=Orange.data.sample.SubsetIndicesCV(folds=nbFolds,randseed=seed)
+    ind=indices(data)
+    return data.select(ind,fold,negate=1),data.select(ind,fold)
+
+def runTask(task):
+    """Run the cells of a (dataset, fold, nbTree) task, training the forest and descending it only if
+    they are not cached on disk.
+
+    Argument:
+    task -- a dictionary with keys dataset, datasetId, seed, nbFolds, fold, nbTree, methods and cachedir
+
+    Return the list of results (dictionaries) of the cells.
+    """
+    start=t.time()
+    training,test=_split(task["dataset"],task["fold"],task["nbFolds"],task["seed"])
+    forestfile=_cachePath(task["cachedir"],"forest",task,"pkl")
+    leavesfile=_cachePath(task["cachedir"],"leaves",task,"npz")
+    forest=None
+    if "forestVote" in task["methods"] or not os.path.exists(leavesfile):
+        if os.path.exists(forestfile):
+            with open(forestfile,"rb") as cachefile:
+                forest=pickle.load(cachefile)
+        else:
+            forest=trainForest(training,task["nbTree"])
+            try:
+                _atomicDump(forest,forestfile,lambda obj,f: pickle.dump(obj,f,pickle.HIGHEST_PROTOCOL))
+            except (pickle.PicklingError,TypeError):
+                # forests that cannot be pickled are retrained, leaves are still cached
+                if os.path.exists(forestfile+".tmp"):
+                    os.remove(forestfile+".tmp")
+    if os.path.exists(leavesfile):
+        cached=np.load(leavesfile)
+        bounds,leaves=cached["bounds"],cached["leaves"]
+    else:
+        intervals=forestIntervals(forest,len(test.domain.class_var.values))
+        leaves=intervals.getLeaves(test)
+        bounds=intervals.bounds
+        _atomicDump({"bounds":bounds,"leaves":leaves},leavesfile,lambda obj,f: np.savez(f,**obj))
+    preparation=t.time()-start
+
+    results=[]
+    cell=dict((key,task[key]) for key in ["dataset","datasetId","seed","nbFolds","fold","nbTree"])
+    fusions=[method for method in task["methods"] if method in COMBINATIONS]
+    if len(fusions) > 0:
+        start=t.time()
+        fusedproba=fuseLeaves(bounds,leaves,fusions,fusionCache())
+        true_class=trueClasses(test)
+        fusiontime=t.time()-start
+        for method in fusions:
+            accuracy,set_accuracy,disc_accuracy=fusionAccuracies(fusedproba[method],true_class)
+            results.append(dict(cell,method=method,accuracy=accuracy,set_accuracy=set_accuracy,
+                                disc_accuracy=disc_accuracy,preparation_time=preparation,time=fusiontime))
+    if "forestVote" in task["methods"]:
+        start=t.time()
+        accuracy=0.
+        for i in range(len(test)):
+            if forest(test[i],Orange.classification.Classifier.GetValue)==test[i].getclass():
+                accuracy+=1
+        results.append(dict(cell,method="forestVote",accuracy=accuracy/len(test),
+                            preparation_time=preparation,time=t.time()-start))
+    if "simpleTree" in task["methods"]:
+        accuracy,tps=test_simpleTree(training,test)
+        results.append(dict(cell,method="simpleTree",accuracy=accuracy,preparation_time=0.,time=tps))
+    return results
+
+def getTasks(datasets,nbTrees,methods,nbFolds,cachedir,seed,done):
+    """Return the list of tasks whose cells are not all in done (a set of cell keys)
+    """
+    tasks=[]
+    for dataset in datasets:
+        for fold in range(nbFolds):
+            for nbTree in nbTrees:
+                task={"dataset":dataset,"datasetId":datasetId(dataset),"seed":seed,"nbFolds":nbFolds,
+                      "fold":fold,"nbTree":nbTree,"cachedir":cachedir}
+                todo=[method for method in methods if cellKey(dict(task,method=method)) not in done]
+                if len(todo) > 0:
+                    tasks.append(dict(task,methods=todo))
+    return tasks
+
+def runSweep(datasets,nbTrees=[1, 20, 50, 100, 150, 200],methods=METHODS,nbFolds=4,cachedir="sweep",
+             nbProcesses=None,seed=0):
+    """Run the tree-count sweep over datasets and folds, cells being split among processes.
+
+    Results are appended to cachedir/results.jsonl as soon as a task ends, and trained forests and
+    leaves reached by test instances are cached in cachedir: running the sweep again resumes it,
+    skipping the cells already done and the training of cached forests. Cells, forests and leaves
+    are identified by the dataset (see datasetId), the seed and the number of folds, so that sweeps
+    with other settings can share cachedir.
+
+    Return the list of results (dictionaries) of all the cells of the sweep (not those of other
+    settings found in cachedir).
+    """
+    for method in methods:
+        if method not in METHODS:
+            raise Exception('Unknown method: %s' % method)
+    if not os.path.isdir(cachedir):
+        os.makedirs(cachedir)
+    resultsfile=os.path.join(cachedir,"results.jsonl")
+    results=loadResults(resultsfile)
+    tasks=getTasks(datasets,nbTrees,methods,nbFolds,cachedir,seed,set([cellKey(result) for result in results]))
+    cells=set([cellKey(dict(task,method=method)) for task in getTasks(datasets,nbTrees,methods,nbFolds,
+                                                                     cachedir,seed,set())
+               for method in task["methods"]])
+    results=[result for result in results if cellKey(result) in cells]
+    if nbProcesses is None:
+        nbProcesses=multiprocessing.cpu_count()
+    if nbProcesses > 1 and len(tasks) > 1:
+        pool=multiprocessing.Pool(min(nbProcesses,len(tasks)))
+        taskresults=pool.imap_unordered(runTask,tasks)
+    else:
+        pool=None
+        taskresults=(runTask(task) for task in tasks)
+    try:
+        with open(resultsfile,"a") as output:
+            if output.tell() > 0 and not _endsWithNewline(resultsfile):
+                # an interrupted line is closed, so that it does not corrupt the next result
+                output.write("\n")
+            for taskresult in taskresults:
+                for result in taskresult:
+                    output.write(json.dumps(result,sort_keys=True)+"\n")
+                output.flush()
+                os.fsync(output.fileno())
+                results.extend(taskresult)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return results
+
+def latexRows(results,dataset):
+    """Return the LaTeX rows of the sweep table of a dataset, values being averaged over folds
+    """
+    means={}
+    for result in results:
+        if result["dataset"] == dataset:
+            key=(result["nbTree"],result["method"])
+            for value in ["accuracy","set_accuracy","disc_accuracy"]:
+                if value in result:
+                    means.setdefault(key+(value,),[]).append(result[value])
+    rows=[]
+    for nbTree in sorted(set([key[0] for key in means])):
+        def mean(method,value="accuracy"):
+            return np.mean(means.get((nbTree,method,value),[np.nan]))
+        row=" & %d" % nbTree+" & %.2f " % mean("simpleTree")+" & %.2f " % mean("forestVote")
+        for method in ["mostMCSconj","almostMCScomb","bestfirstMCS","meanfirstMCSweighted"]:
+            row+=" & %.2f " % mean(method,"disc_accuracy")+" & %.2f " % mean(method,"set_accuracy")+" & %.2f" % mean(method)
+        rows.append(row+" \\\\")
+    return rows
+
+if __name__=='__main__':
+    import argparse
+    parser=argparse.ArgumentParser(description="Parallel and resumable tree-count sweep")
+    parser.add_argument("datasets",nargs="+")
+    parser.add_argument("--trees",type=int,nargs="+",default=[1, 20, 50, 100, 150, 200])
+    parser.add_argument("--methods",nargs="+",default=METHODS)
+    parser.add_argument("--folds",type=int,default=4)
+    parser.add_argument("--cachedir",default="sweep")
+    parser.add_argument("--processes",type=int,default=None)
+    parser.add_argument("--seed",type=int,default=0)
+    args=parser.parse_args()
+    results=runSweep(args.datasets,args.trees,args.methods,args.folds,args.cachedir,args.processes,args.seed)
+    for dataset in args.datasets:
+        print(dataset)
+        for row in latexRows(results,dataset):
+            print(row)
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+class fusionCache:
+    """Class of a bounded cache of fusion results, the least recently used ones being evicted first
+
+    Argument:
+    maxsize -- maximal number of results kept in the cache
+
+    Keys can be any hashable object, e.g. the tuple of the leaves reached in each tree of a
+    forest together with the combination name.
+    """
+
+    def __init__(self,maxsize=10000):
+        if maxsize < 1:
+            raise Exception('Cache size should be at least 1')
+        self.maxsize=maxsize
+        self.entries=OrderedDict()
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self,key):
+        return key in self.entries
+
+    def get(self,key,default=None):
+        """Return the result stored for key (and mark it as recently used), or default if absent
+        """
+        if key in self.entries:
+            self.hits+=1
+            value=self.entries.pop(key)
+            self.entries[key]=value
+            return value
+        self.misses+=1
+        return default
+
+    def put(self,key,value):
+        """Store the result of key, evicting the least recently used results if the cache is full
+        """
+        if key in self.entries:
+            self.entries.pop(key)
+        self.entries[key]=value
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions+=1
+
+    def clear(self):
+        """Remove all stored results (statistics are kept)
+        """
+        self.entries.clear()
+
+    def getStats(self):
+        """Return a dictionary of hit/miss statistics
+        """
+        requests=self.hits+self.misses
+        return {'hits':self.hits,'misses':self.misses,'evictions':self.evictions,'size':len(self.entries),
+                'maxsize':self.maxsize,'hitrate':self.hits/float(requests) if requests > 0 else 0.}
@@ -0,0 +1,74 @@
+import timeit
+import numpy as np
+
+class fusionStats:
+    """Class collecting timings and counters of the stages of combinations and decisions
+
+    Argument:
+    callback -- optional function called as callback(stage, elapsed) each time a stage ends
+
+    A fusionStats is given to setOfIntProba, intervalsProbability or batchIntervalsProbability
+    objects (stats argument), which then report to it (objects without stats report nothing). Timed
+    stages are 'combination', 'mcs' (search of 'almost' MCS), 'conjunction', 'discount',
+    'disjunction', 'reachability' and 'decision'. A stage nested in another one is timed in both
+    (e.g. the reachability repair of a decision), a stage nested in itself is timed once.
+
+    Counters are 'candidates' (sets produced by splits), 'duplicates' and 'subsumed' (sets removed),
+    'explored' and 'pruned' (sets popped by the best-first search), 'mcs' (MCS found) and
+    'discounted' (incompatible sets discounted); values are 'mcssize' (sizes of MCS) and 'discount'
+    (discount factors applied).
+    """
+
+    def __init__(self,callback=None):
+        self.callback=callback
+        self.reset()
+
+    def reset(self):
+        """Forget all timings, counters and values (e.g. between two instances)
+        """
+        self.times={}
+        self.calls={}
+        self.counters={}
+        self.values={}
+        self.depth={}
+        self.started={}
+
+    def begin(self,stage):
+        """Start timing a stage
+        """
+        depth=self.depth.get(stage,0)
+        if depth == 0:
+            self.started[stage]=timeit.default_timer()
+        self.depth[stage]=depth+1
+
+    def end(self,stage):
+        """Stop timing a stage (started by begin)
+        """
+        self.depth[stage]-=1
+        if self.depth[stage] == 0:
+            elapsed=timeit.default_timer()-self.started[stage]
+            self.times[stage]=self.times.get(stage,0.)+elapsed
+            self.calls[stage]=self.calls.get(stage,0)+1
+            if self.callback is not None:
+                self.callback(stage,elapsed)
+
+    def count(self,name,number=1):
+        """Increase a counter
+        """
+        self.counters[name]=self.counters.get(name,0)+number
+
+    def record(self,name,values):
+        """Record a value, or a sequence of values
+        """
+        self.values.setdefault(name,[]).extend(np.atleast_1d(values).tolist())
+
+    def getStats(self):
+        """Return a dictionary of the total time and number of calls of each stage, of the counters
+        and of the number, min, mean and max of the recorded values
+        """
+        summaries={}
+        for name,values in self.values.items():
+            summaries[name]={'number':len(values),'min':min(values),'mean':sum(values)/float(len(values)),
+                             'max':max(values)}
+        return {'times':dict(self.times),'calls':dict(self.calls),'counters':dict(self.counters),
+                'values':summaries}
@@ -1,72 +1,131 @@
+import functools
+import heapq
+from collections import OrderedDict
 import numpy as np
-import Orange
+from fusionCache import fusionCache
 
-def getMaxCoherentIntervals(setOfInt):
-    """Find and return the maximal subsets of coherent intervals from a list of intervals 
+def _timedStage(stage):
+    """Decorator timing a method as a stage in the stats (see fusionStats) of its object, if any
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def timed(self,*args,**kwargs):
+            if self.stats is None:
+                return method(self,*args,**kwargs)
+            self.stats.begin(stage)
+            try:
+                return method(self,*args,**kwargs)
+            finally:
+                self.stats.end(stage)
+        return timed
+    return decorate
+
+def getMaxCoherentRanks(setOfInt,touching=False):
+    """Find the maximal subsets of coherent intervals from a list of intervals, in a compact form
 
     Argument:
     setOfInt -- a 2xn array containing upper (1st row) and lower (2nd row) bounds of intervals    
+    touching -- if True, the subsets are those of the original sweep: a subset is also found when a
+                lower bound equals the lowest upper bound not passed yet (it may then not be maximal),
+                and bounds are sorted by the default (unstable) numpy sort
+
+    Return a tuple (indlow, indup, starts, ends) where indlow (indup) are the indices of intervals
+    sorted by lower (upper) bounds. The k-th maximal subset is made of the intervals indlow[:ends[k]]
+    minus the intervals indup[:starts[k]], and counts ends[k]-starts[k] intervals.
     """
-    # separate and setting up indices of sorted interval bounds
     upper=setOfInt[0,:]
     lower=setOfInt[1,:]
-    indup=upper.argsort()
-    indlow=lower.argsort()
-    sortup=np.sort(upper)
-    sortlow=np.sort(lower)
-    # initializing variables for MCS detection
-    MCSlist=[]
-    currentMCS=[]
-    ind_up=0
-    ind_low=0 
-    for i in range(2*upper.size-1):
-        # deals with possible equality of next value
-        if sortup[ind_up] == sortlow[ind_low]:
-            currentMCS.append(indlow[ind_low])
-            ind_low=ind_low+1
-            # no more lower bounds encountered (reach end of lower)
-            if ind_low == upper.size:
-                MCSlist.append(currentMCS[:])
-                break
-            MCSlist.append(currentMCS[:])
-        # first case: the next value is a lower bound
-        elif sortlow[ind_low] < sortup[ind_up]:
-            currentMCS.append(indlow[ind_low])
-            ind_low=ind_low+1
-            # no more lower bounds encountered (reach end of lower)
-            if ind_low == upper.size:
-                MCSlist.append(currentMCS[:])
-                break
-            # case where a lower bound is followed by an upper bound
-            if min(sortlow[ind_low],sortup[ind_up]) < sortlow[ind_low]:
-                MCSlist.append(currentMCS[:])
-        # second case: the next value is an upper bound
-        else:
-            currentMCS.remove(indup[ind_up])
-            ind_up=ind_up+1
-    return MCSlist
-    
+    kind='quicksort' if touching else 'mergesort'
+    indup=upper.argsort(kind=kind)
+    indlow=lower.argsort(kind=kind)
+    # number of upper bounds passed (strictly lower) when reaching each lower bound
+    passed=np.searchsorted(upper[indup],lower[indlow],side='left')
+    # a maximal subset is reached when the next lower bound comes after an upper bound (or at the end)
+    maximal=np.ones(lower.size,dtype=bool)
+    maximal[:-1]=passed[1:] > passed[:-1]
+    if touching:
+        maximal[:-1]|=upper[indup][passed[:-1]] == lower[indlow][:-1]
+    ends=np.flatnonzero(maximal)+1
+    starts=passed[maximal]
+    return indlow,indup,starts,ends
+
+def iterMaxCoherentIntervals(setOfInt,touching=False):
+    """Generate lazily the maximal subsets of coherent intervals from a list of intervals
+
+    Argument:
+    setOfInt -- a 2xn array containing upper (1st row) and lower (2nd row) bounds of intervals    
+    touching -- see getMaxCoherentRanks
+
+    Yield the arrays of indices of the intervals in each maximal subset, sorted by lower bounds.
+    """
+    indlow,indup,starts,ends=getMaxCoherentRanks(setOfInt,touching)
+    rankup=np.empty(indup.size,dtype=int)
+    rankup[indup]=np.arange(indup.size)
+    for k in range(ends.size):
+        candidates=indlow[:ends[k]]
+        yield candidates[rankup[candidates] >= starts[k]]
+
+def getMaxCoherentIntervals(setOfInt,touching=False):
+    """Find and return the maximal subsets of coherent intervals from a list of intervals 
+
+    Argument:
+    setOfInt -- a 2xn array containing upper (1st row) and lower (2nd row) bounds of intervals    
+    touching -- see getMaxCoherentRanks
+    """
+    return [list(MCS) for MCS in iterMaxCoherentIntervals(setOfInt,touching)]
+
+# largest frame whose 2^n events are tabulated (each table of 2^25 floats takes 256MB)
+MAXTABLEDECISION=25
 
-class intervalsProbability:
+def subsetSums(values):
+    """Compute the sums of values over all the subsets of elements
+
+    Argument:
+    values -- a vector of n values, one per element
+
+    Return a vector of size 2^n whose entry of index A is the sum of values over the elements of bitmask A.
+    """
+    sums=np.zeros(2**values.size)
+    for i in range(values.size):
+        # subsets of the i+1 first elements that contain element i
+        sums[2**i:2**(i+1)]=sums[:2**i]+values[i]
+    return sums
+
+
+class intervalsProbability(object):
     """Class of probability intervals: upper and lower prob. bounds on singletons
 
     Argument:
     lproba -- a 2xn array containing upper (1st row) and lower (2nd row) probabilistic bounds
+    stats -- optional fusionStats timing reachability repairs and decisions
     
+    The object remembers whether its bounds are reachable; this state is reset when
+    lproba is assigned, but not when the array is modified in place.
     """
     
-    def __init__(self,lproba):
+    def __init__(self,lproba,stats=None):
         if lproba.__class__.__name__ != 'ndarray':
             raise Exception('Expecting a numpy array as argument')
-        if lproba[:,1].size != 2:
-            raise Exception('Array should contain two rows: top for upper prob, bottom for lower prob')
         if lproba.ndim != 2:
             raise Exception('Bad dimension of array: should contain 2 dimensions')
+        if lproba.shape[0] != 2:
+            raise Exception('Array should contain two rows: top for upper prob, bottom for lower prob')
         self.lproba=lproba
         self.nbDecision=lproba[0].size
+        self.stats=stats
         if np.all(lproba[0] >=lproba[1]) != 1:
             raise Exception('Some upper bounds lower than lower bounds')
 
+    def _getLproba(self):
+        return self._lproba
+
+    def _setLproba(self,lproba):
+        self._lproba=lproba
+        # None: reachability not known yet
+        self._reachable=None
+
+    lproba=property(_getLproba,_setLproba)
+
     def isProper(self):
         """Check if probability intervals induce a non-empty probability set. 
         
@@ -114,6 +173,73 @@ class intervalsProbability:
         upperProbability=min(self.lproba[0,subset[:]==1].sum(),1-self.lproba[1,subset[:]==0].sum())
         return upperProbability
 
+    def getEventsProbability(self,events):
+        """Compute upper and lower probabilities of several events at once.
+
+        Argument:
+        events -- either a kxn 0/1 (or boolean) matrix, each row coding an event as in getLowerProbability,
+                  or a vector of k integer bitmasks (bit i set if element i is in the event), for frames
+                  of at most 63 elements.
+
+        Return a 2xk array containing upper (1st row) and lower (2nd row) probabilities of the events.
+
+        """
+        if events.__class__.__name__!='ndarray':
+            raise Exception('Expecting a numpy array as argument')
+        if events.ndim == 1:
+            if events.dtype.kind not in 'iu':
+                raise Exception('Expecting integer bitmasks as a vector of events')
+            if self.nbDecision > 63:
+                raise Exception('Bitmasks limited to frames of at most 63 elements: use a 0/1 matrix of events')
+            # checked on python integers, so that no dtype (uint64, narrow ints) wraps or overflows
+            if events.size and (int(events.min()) < 0 or int(events.max()) >= 2**self.nbDecision):
+                raise Exception('Bitmasks incompatible with the frame size')
+            events=(events.astype(np.int64)[:,np.newaxis] >> np.arange(self.nbDecision,dtype=np.int64)) & 1
+        elif events.ndim != 2 or events.shape[1] != self.nbDecision:
+            raise Exception('Events incompatible with the frame size')
+        if self.isReachable()==0:
+            self.setReachableProbability()
+        # sums of upper (1st column) and lower (2nd column) bounds over each event
+        insums=np.dot(events.astype(float),self.lproba.T)
+        outsums=self.lproba.sum(axis=1)-insums
+        eventsProbability=np.zeros((2,events.shape[0]))
+        eventsProbability[0,:]=np.minimum(insums[:,0],1-outsums[:,1])
+        eventsProbability[1,:]=np.maximum(insums[:,1],1-outsums[:,0])
+        return eventsProbability
+
+    def getProbabilityTables(self):
+        """Compute upper and lower probabilities of all the 2^n events (frames of at most
+        MAXTABLEDECISION elements).
+
+        Return a 2x2^n array containing upper (1st row) and lower (2nd row) probabilities, the
+        column of an event being its bitmask (bit i set if element i is in the event).
+
+        """
+        if self.nbDecision > MAXTABLEDECISION:
+            raise Exception('Frame too large to tabulate all events: at most %d elements' % MAXTABLEDECISION)
+        if self.isReachable()==0:
+            self.setReachableProbability()
+        upsums=subsetSums(self.lproba[0,:])
+        lowsums=subsetSums(self.lproba[1,:])
+        # the complement of event A is at index 2^n-1-A, i.e. reversed tables
+        tables=np.zeros((2,upsums.size))
+        tables[0,:]=np.minimum(upsums,1-lowsums[::-1])
+        tables[1,:]=np.maximum(lowsums,1-upsums[::-1])
+        return tables
+
+    def getMobiusInverse(self):
+        """Compute the Mobius inverse of the lower probability (frames of at most MAXTABLEDECISION elements).
+
+        Return a vector of size 2^n containing the mass of each event, indexed by bitmask.
+
+        """
+        mobius=self.getProbabilityTables()[1,:]
+        for i in range(self.nbDecision):
+            # pairs events without/with element i: mass(A+i) -= mass(A)
+            pairs=mobius.reshape(-1,2,2**i)
+            pairs[:,1,:]-=pairs[:,0,:]
+        return mobius
+
     def isReachable(self):
         """Check if the probability intervals are reachable (are coherent / correspond to tightest possible 
         constraints) 
@@ -121,31 +247,36 @@ class intervalsProbability:
         Return a 0/1 value (1: are reachable).
         
         """    
-        for i in range(self.nbDecision):
-            subset=np.ones(self.nbDecision)
-            subset[i]=0
-            if self.lproba[0,i] + self.lproba[1,subset[:]==1].sum()  > 1.0:
-                return 0
-            if self.lproba[1,i] + self.lproba[0,subset[:]==1].sum() < 1.0:
-                return 0
-        return 1
+        if self._reachable is None:
+            upper=self.lproba[0,:]
+            lower=self.lproba[1,:]
+            # sum of the bounds over all elements but the considered one
+            othlower=lower.sum()-lower
+            othupper=upper.sum()-upper
+            if np.any(upper+othlower > 1.0) or np.any(lower+othupper < 1.0):
+                self._reachable=0
+            else:
+                self._reachable=1
+        return self._reachable
 
+    @_timedStage("reachability")
     def setReachableProbability(self):
         """Make the bounds reachable and return them. 
         """    
         if self.isProper()==1:
+            upper=self.lproba[0,:]
+            lower=self.lproba[1,:]
+            othlower=lower.sum()-lower
+            othupper=upper.sum()-upper
             lreachableProba=np.zeros((2,self.nbDecision))
-            for i in range(self.nbDecision):
-                subset=np.ones(self.nbDecision)
-                subset[i]=0
-                lb=max(self.lproba[1,i],1-self.lproba[0,subset[:]==1].sum())
-                ub=min(self.lproba[0,i],1-self.lproba[1,subset[:]==1].sum())
-                lreachableProba[1,i]=lb
-                lreachableProba[0,i]=ub
+            lreachableProba[1,:]=np.maximum(lower,1-othupper)
+            lreachableProba[0,:]=np.minimum(upper,1-othlower)
             self.lproba[:]=lreachableProba[:]
+            self._reachable=1
         else:
             raise Exception('intervals inducing empty set: operation not possible')
             
+    @_timedStage("decision")
     def nc_maximin_decision(self):
         """Return the maximin classification decision (nc: no costs)
         """
@@ -153,6 +284,7 @@ class intervalsProbability:
             self.setReachableProbability()
         return self.lproba[1,:].argmax()
         
+    @_timedStage("decision")
     def nc_maximax_decision(self):
         """Return the maximax classification decision (nc: no costs)
         """
@@ -160,6 +292,7 @@ class intervalsProbability:
             self.setReachableProbability()
         return self.lproba[0,:].argmax()
         
+    @_timedStage("decision")
     def nc_hurwicz_decision(self,alpha):
         """Return the maximax classification decision (nc: no costs)
         """
@@ -168,18 +301,113 @@ class intervalsProbability:
         hurwicz=alpha*self.lproba[0,:]+(1-alpha)*self.lproba[1,:]
         return hurwicz.argmax()
         
+    @_timedStage("decision")
     def nc_maximal_decision(self):
         """Return the classification decisions that are maximal (nc: no costs)
+
+        Return a vector of n booleans (True for maximal decisions).
         """
         if self.isReachable()==0:
             self.setReachableProbability()
-        maximality_classe=np.ones(self.nbDecision)
-        for i in range(self.nbDecision):
-            for j in range(self.nbDecision):
-                if i != j and maximality_classe[i] == 1 and maximality_classe[j] == 1:
-                    if -self.lproba[0,j]+self.lproba[1,i] > 0:
-                        maximality_classe[j]=0
-        return maximality_classe
+        # a class is dominated when its upper bound is below the highest lower bound of the other classes
+        lower=self.lproba[1,:]
+        best=lower.argmax()
+        maxother=np.empty(self.nbDecision)
+        maxother[:]=lower[best]
+        maxother[best]=np.delete(lower,best).max() if self.nbDecision > 1 else -np.inf
+        return self.lproba[0,:] >= maxother
+
+    def getLowerExpectation(self,gamble):
+        """Compute the lower expectation of one or several gambles (real-valued functions on the elements).
+
+        Argument:
+        gamble -- a vector of n values, or a kxn matrix with one gamble per row.
+
+        Return the lower expectation value (a vector of k values for a matrix).
+
+        """
+        if gamble.__class__.__name__!='ndarray':
+            raise Exception('Expecting a numpy array as argument')
+        if gamble.shape[-1] != self.nbDecision or gamble.ndim > 2:
+            raise Exception('Gamble incompatible with the frame size')
+        if self.isReachable()==0:
+            self.setReachableProbability()
+        if gamble.ndim == 1:
+            return self._lowerExpectations(gamble[np.newaxis,:])[0]
+        return self._lowerExpectations(gamble)
+
+    def getUpperExpectation(self,gamble):
+        """Compute the upper expectation of one or several gambles (real-valued functions on the elements).
+
+        Argument:
+        gamble -- a vector of n values, or a kxn matrix with one gamble per row.
+
+        Return the upper expectation value (a vector of k values for a matrix).
+
+        """
+        return -self.getLowerExpectation(-gamble)
+
+    def _lowerExpectations(self,gambles):
+        """Internal function computing lower expectations of the rows of a kxn matrix of gambles.
+
+        The probability mass left once lower bounds are given is greedily allocated to the
+        elements of lowest values, up to their upper bounds.
+        """
+        order=gambles.argsort(axis=1)
+        sortgambles=gambles[np.arange(gambles.shape[0])[:,np.newaxis],order]
+        sortlower=self.lproba[1,order]
+        sortwidth=self.lproba[0,order]-sortlower
+        remaining=1-self.lproba[1,:].sum()
+        # mass already allocated to the elements of lower values
+        before=sortwidth.cumsum(axis=1)-sortwidth
+        allocated=np.clip(remaining-before,0,sortwidth)
+        return (sortgambles*(sortlower+allocated)).sum(axis=1)
+
+    def _checkCosts(self,costs):
+        """Internal function checking that a cost matrix fits the frame.
+        """
+        if costs.__class__.__name__!='ndarray':
+            raise Exception('Expecting a numpy array as argument')
+        if costs.ndim != 2 or costs.shape[1] != self.nbDecision:
+            raise Exception('Costs should be a dxn array: one row per decision, one column per element')
+
+    @_timedStage("decision")
+    def maximin_decision(self,costs):
+        """Return the decision minimizing the upper expected cost
+
+        Argument:
+        costs -- a dxn array, costs[i,k] being the cost of decision i when the true element is k.
+        """
+        self._checkCosts(costs)
+        return self.getUpperExpectation(costs).argmin()
+
+    @_timedStage("decision")
+    def maximal_decision(self,costs):
+        """Return the decisions that are maximal w.r.t. the expected costs
+
+        Argument:
+        costs -- a dxn array, costs[i,k] being the cost of decision i when the true element is k.
+
+        Return a vector of d booleans (True for maximal decisions).
+        """
+        self._checkCosts(costs)
+        nbdec=costs.shape[0]
+        # decision j is dominated by i if the lower expectation of costs[j]-costs[i] is positive
+        pairs=(costs[np.newaxis,:,:]-costs[:,np.newaxis,:]).reshape(nbdec*nbdec,self.nbDecision)
+        dominated=self.getLowerExpectation(pairs).reshape(nbdec,nbdec) > 0
+        return ~dominated.any(axis=0)
+
+    @_timedStage("decision")
+    def intervaldom_decision(self,costs):
+        """Return the decisions that are not interval-dominated w.r.t. the expected costs
+
+        Argument:
+        costs -- a dxn array, costs[i,k] being the cost of decision i when the true element is k.
+
+        Return a vector of d booleans (True for non-dominated decisions).
+        """
+        self._checkCosts(costs)
+        return self.getLowerExpectation(costs) <= self.getUpperExpectation(costs).min()
 
     def printProbability(self):
         """Print the current bounds 
@@ -196,7 +424,289 @@ class intervalsProbability:
         print " "*11, "-"*20
         print str1
         print str2
-        
+
+class batchIntervalsProbability:
+    """Class of a batch of probability intervals, processed all at once
+
+    Argument:
+    lproba -- a Nx2xn array containing upper (1st row) and lower (2nd row) probabilistic bounds
+
+              dim 1: index of the probability intervals (e.g., of a test instance)
+              dim 2: upper or lower prob bounds
+              dim 3: values of bounds on each element
+    stats -- optional fusionStats timing reachability repairs and decisions
+    """
+
+    def __init__(self,lproba,stats=None):
+        if lproba.__class__.__name__ != 'ndarray':
+            raise Exception('Expecting a numpy array as argument')
+        if lproba.ndim != 3:
+            raise Exception('Bad dimension of array: should contain 3 dimensions')
+        if lproba.shape[1] != 2:
+            raise Exception('Array should contain two rows per intervals: top for upper prob, bottom for lower prob')
+        self.lproba=lproba
+        self.nbIntervals=lproba.shape[0]
+        self.nbDecision=lproba.shape[2]
+        self.stats=stats
+        if np.all(lproba[:,0,:] >= lproba[:,1,:]) != 1:
+            raise Exception('Some upper bounds lower than lower bounds')
+
+    def getIntervalsProbability(self,index):
+        """Return the intervalsProbability object of a given index (bounds are shared, not copied)
+        """
+        return intervalsProbability(self.lproba[index],self.stats)
+
+    def isProper(self):
+        """Check for each probability intervals if they induce a non-empty probability set.
+
+        Return a vector of N 0 (empty) or 1 (non-empty) values.
+
+        """
+        proper=(self.lproba[:,1,:].sum(axis=1) <= 1) & (self.lproba[:,0,:].sum(axis=1) >= 1)
+        return proper.astype(int)
+
+    def isReachable(self):
+        """Check for each probability intervals if they are reachable
+
+        Return a vector of N 0/1 values (1: are reachable).
+
+        """
+        upper=self.lproba[:,0,:]
+        lower=self.lproba[:,1,:]
+        # sum of the bounds over all elements but the considered one
+        othlower=lower.sum(axis=1)[:,np.newaxis]-lower
+        othupper=upper.sum(axis=1)[:,np.newaxis]-upper
+        reachable=np.all(upper+othlower <= 1.0,axis=1) & np.all(lower+othupper >= 1.0,axis=1)
+        return reachable.astype(int)
+
+    @_timedStage("reachability")
+    def setReachableProbability(self):
+        """Make all the bounds reachable and return them.
+        """
+        if np.all(self.isProper()==1):
+            self.lproba[:]=self._reachableBounds(self.lproba)
+            return self.lproba
+        else:
+            raise Exception('intervals inducing empty set: operation not possible')
+
+    def _reachableBounds(self,lproba):
+        """Internal function computing the reachable version of a stack of bounds.
+        """
+        upper=lproba[:,0,:]
+        lower=lproba[:,1,:]
+        othlower=lower.sum(axis=1)[:,np.newaxis]-lower
+        othupper=upper.sum(axis=1)[:,np.newaxis]-upper
+        lreachableProba=np.zeros(lproba.shape)
+        lreachableProba[:,1,:]=np.maximum(lower,1-othupper)
+        lreachableProba[:,0,:]=np.minimum(upper,1-othlower)
+        return lreachableProba
+
+    @_timedStage("reachability")
+    def _makeReachable(self):
+        """Internal function making reachable the bounds that are not, leaving the others untouched.
+        """
+        notreachable=np.flatnonzero(self.isReachable()==0)
+        if notreachable.size > 0:
+            if np.all(self.isProper()[notreachable]==1) != 1:
+                raise Exception('intervals inducing empty set: operation not possible')
+            self.lproba[notreachable]=self._reachableBounds(self.lproba[notreachable])
+
+    @_timedStage("decision")
+    def nc_maximin_decision(self):
+        """Return the N maximin classification decisions (nc: no costs)
+        """
+        self._makeReachable()
+        return self.lproba[:,1,:].argmax(axis=1)
+
+    @_timedStage("decision")
+    def nc_maximax_decision(self):
+        """Return the N maximax classification decisions (nc: no costs)
+        """
+        self._makeReachable()
+        return self.lproba[:,0,:].argmax(axis=1)
+
+    @_timedStage("decision")
+    def nc_hurwicz_decision(self,alpha):
+        """Return the N hurwicz classification decisions (nc: no costs)
+        """
+        self._makeReachable()
+        hurwicz=alpha*self.lproba[:,0,:]+(1-alpha)*self.lproba[:,1,:]
+        return hurwicz.argmax(axis=1)
+
+    @_timedStage("decision")
+    def nc_maximal_decision(self):
+        """Return, for each of the N intervals, the classification decisions that are maximal (nc: no costs)
+
+        Return a Nxn array of booleans (True for maximal decisions).
+        """
+        self._makeReachable()
+        lower=self.lproba[:,1,:]
+        rows=np.arange(self.nbIntervals)
+        best=lower.argmax(axis=1)
+        # highest lower bound of the other classes: the best one, or the second best for the best class
+        maxother=np.empty(lower.shape)
+        maxother[:]=lower[rows,best][:,np.newaxis]
+        if self.nbDecision > 1:
+            maxother[rows,best]=np.partition(lower,-2,axis=1)[:,-2]
+        else:
+            maxother[rows,best]=-np.inf
+        return self.lproba[:,0,:] >= maxother
+
+def weightedSum(values,weights=None):
+    """Sum values, each one counting weights times (once if weights is None)
+    """
+    if weights is None:
+        return values.sum()
+    return np.dot(weights,values)
+
+def areCompatibleBounds(maxlower,minupper,weights=None):
+    """Check whether intervals are compatible from the extreme values of their bounds
+
+    Argument:
+    maxlower -- a vector containing, for each element, the maximum of the lower bounds
+    minupper -- a vector containing, for each element, the minimum of the upper bounds
+    weights -- optional multiplicities of the elements, when a value stands for several elements
+               sharing the same bounds (see sparseSetOfIntProba)
+
+    Return 1 if the conjunction is non-empty, 0 if empty
+    """
+    if weightedSum(maxlower,weights) >= 1 or weightedSum(minupper,weights) <= 1 or np.any(maxlower >= minupper):
+        return 0
+    return 1
+
+def conjunctiveBounds(maxlower,minupper,weights=None):
+    """Compute the (reachable) bounds of the conjunction of intervals from the extreme values of their bounds
+
+    Argument:
+    maxlower -- a vector containing, for each element, the maximum of the lower bounds
+    minupper -- a vector containing, for each element, the minimum of the upper bounds
+    weights -- optional multiplicities of the elements (see areCompatibleBounds)
+
+    Return a 2xn array containing upper (1st row) and lower (2nd row) bounds
+    """
+    fusedproba=np.zeros((2,maxlower.size))
+    # sum of the bounds over all elements but the considered one
+    fusedproba[1,:]=np.maximum(maxlower,1-(weightedSum(minupper,weights)-minupper))
+    fusedproba[0,:]=np.minimum(minupper,1-(weightedSum(maxlower,weights)-maxlower))
+    return fusedproba
+
+def keepMaximalSets(masks):
+    """Find the sets that are neither duplicated nor included in another one
+
+    Argument:
+    masks -- a kxm boolean array, each row coding a subset of m objects
+
+    Return the indices of the rows to keep, in increasing order (first occurrence of duplicates).
+    """
+    # packing rows as bitsets of 64 bits words
+    nbwords=(masks.shape[1]+63)//64
+    packed=np.zeros((masks.shape[0],8*nbwords),dtype=np.uint8)
+    packed[:,:(masks.shape[1]+7)//8]=np.packbits(masks,axis=1)
+    words=packed.view(np.uint64)
+    # removing duplicates by hashing the bitsets
+    unique={}
+    for i in range(masks.shape[0]):
+        unique.setdefault(packed[i].tostring(),i)
+    first=np.array(sorted(unique.values()),dtype=int)
+    # a set can only be included in a larger one: sets are sorted by decreasing size
+    sizes=masks[first].sum(axis=1)
+    order=first[np.argsort(-sizes,kind='mergesort')]
+    sizes=sizes[np.argsort(-sizes,kind='mergesort')]
+    words=words[order]
+    included=np.zeros(order.size,dtype=bool)
+    block=max(1,2**22//max(1,order.size*nbwords))
+    for start in range(0,order.size,block):
+        end=min(start+block,order.size)
+        # set i is included in set j if no element of i lies outside j
+        inclusion=~np.any(words[start:end,np.newaxis,:] & ~words[np.newaxis,:end,:],axis=2)
+        inclusion&=sizes[np.newaxis,:end] > sizes[start:end,np.newaxis]
+        included[start:end]=inclusion.any(axis=1)
+    return np.sort(order[~included])
+
+def maskOrder(masks,sizes=None):
+    """Order sets in mask order: set A comes before set B if the lowest object belonging to only
+    one of them belongs to A (for sets of equal sizes, the one with the lowest first differing member
+    comes first)
+
+    Argument:
+    masks -- a kxm boolean array, each row coding a subset of m objects
+    sizes -- optional vector of the sizes of the sets: sets are then ordered by decreasing size
+             first, and in mask order between sets of equal sizes
+
+    Return the indices sorting the rows (duplicates kept in their order).
+    """
+    # a set comes first when its packed bytes are the greatest: lexsort on complemented bytes
+    complemented=~np.packbits(masks,axis=1).reshape(masks.shape[0],-1)
+    keys=list(complemented.T[::-1])
+    if sizes is not None:
+        keys.append(-np.asarray(sizes))
+    if len(keys) == 0:
+        return np.arange(masks.shape[0])
+    return np.lexsort(keys)
+
+class intProbaAccumulator:
+    """Class merging probability intervals one at a time, without storing them
+
+    Argument:
+    nbDecision -- size of the frame
+
+    Only the running extreme values of the bounds are kept, so that the conjunction and
+    disjunction of all the intervals added so far can be obtained at any time.
+    """
+
+    def __init__(self,nbDecision):
+        self.nbDecision=nbDecision
+        self.nbProbInt=0
+        self.maxlower=np.zeros(nbDecision)
+        self.minupper=np.ones(nbDecision)
+        self.minlower=np.ones(nbDecision)
+        self.maxupper=np.zeros(nbDecision)
+
+    def add(self,lproba):
+        """Add probability intervals to the accumulator
+
+        Argument:
+        lproba -- a 2xn array (one probability intervals) or a mx2xn array (m probability intervals)
+        """
+        if lproba.__class__.__name__ != 'ndarray':
+            raise Exception('Expecting a numpy array as argument')
+        if lproba.ndim == 2:
+            lproba=lproba[np.newaxis,:,:]
+        if lproba.ndim != 3 or lproba.shape[1] != 2 or lproba.shape[2] != self.nbDecision:
+            raise Exception('Bounds incompatible with the frame size')
+        np.maximum(self.maxlower,lproba[:,1,:].max(axis=0),out=self.maxlower)
+        np.minimum(self.minupper,lproba[:,0,:].min(axis=0),out=self.minupper)
+        np.minimum(self.minlower,lproba[:,1,:].min(axis=0),out=self.minlower)
+        np.maximum(self.maxupper,lproba[:,0,:].max(axis=0),out=self.maxupper)
+        self.nbProbInt+=lproba.shape[0]
+
+    def areCompatible(self):
+        """Check whether the added probability intervals are compatible, i.e., if the conjunction is non-empty.
+
+        Return 1 if non-empty, 0 if empty
+        """
+        return areCompatibleBounds(self.maxlower,self.minupper)
+
+    def conjunction(self):
+        """Perform a conjunctive merging of the added probability intervals
+
+        Return a possibly non-proper intervalsProbability class object.
+        """
+        if self.nbProbInt == 0:
+            raise Exception('No probability intervals added')
+        if self.areCompatible() == 0:
+            raise Exception('Probability intervals not compatible, conjunction empty')
+        return intervalsProbability(conjunctiveBounds(self.maxlower,self.minupper))
+
+    def disjunction(self):
+        """Perform a disjunctive merging of the added probability intervals
+
+        Return an intervalsProbability class object.
+        """
+        if self.nbProbInt == 0:
+            raise Exception('No probability intervals added')
+        return intervalsProbability(np.array([self.maxupper,self.minlower]))
+
 class setOfIntProba:
     """Class to handle sets of Int Proba
 
@@ -207,210 +717,700 @@ class setOfIntProba:
                dim 1: index of probability set
                dim 2: lower or upper prob bounds
                dim 3: values of bounds on each element
+               
+               It can be a numpy memmap (see memmapSetOfIntProba), and is never modified.
+    stats -- optional fusionStats collecting timings and counters of the combination stages, also
+             given to the resulting intervalsProbability objects
+    chunksize -- number of probability intervals read at once when merging them (default: all of
+                 them for arrays, blocks of about 8MB for memmaps)
+    weights -- optional multiplicities of the elements, when a column of bounds stands for several
+               elements sharing them (see sparseSetOfIntProba)
+    maximal -- if True, only the maximal 'almost' MCS are kept (sets included in other ones are
+               removed at each step, see getMCSMasks), which is faster on large stacks but may
+               change the results of the combinations; by default, the 'almost' MCS are the original ones
+
+    Discounting (see discountnoncomp) does not modify intlist: the discount factor is kept in
+    discount, and applied to the bounds as they are read.
     """
     
-    def __init__(self,intlist):
-        if intlist.__class__.__name__ != 'ndarray':
+    def __init__(self,intlist,stats=None,chunksize=None,weights=None,maximal=False):
+        if intlist.__class__.__name__ not in ['ndarray','memmap']:
             raise Exception('Expecting a numpy array as argument')
         if intlist.ndim != 3:
             raise Exception('Expecting a 3-dimensional array')
         self.intlist=intlist
         self.nbProbInt=intlist[:,0,0].size
         self.nbDecision=intlist[0,0].size
+        self.stats=stats
+        if chunksize is None and intlist.__class__.__name__ == 'memmap':
+            chunksize=2**20//(2*self.nbDecision)
+        self.chunksize=None if chunksize is None else max(1,chunksize)
+        self.discount=1.
+        self.weights=weights
+        self.nbElements=self.nbDecision if weights is None else weights.sum()
+        self.maximal=maximal
+
+    def getIntervals(self,members=None):
+        """Return the (discounted) bounds of the probability intervals, as a new kx2xn array
+
+        Argument:
+        members -- indices of the k probability intervals to return (default: all of them)
+        """
+        if members is None:
+            members=np.arange(self.nbProbInt)
+        return self._discounted(np.array(self.intlist[members]))
+
+    def _discounted(self,bounds):
+        """Internal function applying the discount factor to an array of bounds (upper bounds being
+        in bounds[...,0,:] and lower bounds in bounds[...,1,:]), in place.
+        """
+        if self.discount != 1.:
+            bounds[...,1,:]*=self.discount
+            bounds[...,0,:]*=self.discount
+            bounds[...,0,:]+=1-self.discount
+        return bounds
+
+    def _reduceBounds(self,members=None,conjunctive=True):
+        """Internal function computing, chunk by chunk, the extreme (discounted) bounds of some probability intervals.
+
+        Argument:
+        members -- indices of the probability intervals (default: all of them)
+        conjunctive -- if True, return the highest lower and lowest upper bounds, else the lowest
+                       lower and highest upper bounds
+
+        Return a tuple (lower, upper) of vectors.
+        """
+        if self.chunksize is None:
+            chunks=[slice(None) if members is None else members]
+        elif members is None:
+            chunks=[slice(start,start+self.chunksize) for start in range(0,self.nbProbInt,self.chunksize)]
+        else:
+            chunks=[members[start:start+self.chunksize] for start in range(0,members.size,self.chunksize)]
+        lower=None
+        for rows in chunks:
+            if conjunctive:
+                chunk=(self.intlist[rows,1,:].max(axis=0),self.intlist[rows,0,:].min(axis=0))
+            else:
+                chunk=(self.intlist[rows,1,:].min(axis=0),self.intlist[rows,0,:].max(axis=0))
+            if lower is None:
+                lower,upper=chunk
+            elif conjunctive:
+                lower,upper=np.maximum(lower,chunk[0]),np.minimum(upper,chunk[1])
+            else:
+                lower,upper=np.minimum(lower,chunk[0]),np.maximum(upper,chunk[1])
+        if self.discount != 1.:
+            # discounting is increasing: it can be applied to the extreme bounds
+            lower=lower*self.discount
+            upper=upper*self.discount+(1-self.discount)
+        return lower,upper
         
     def areCompatible(self):
         """Check whether the set of probability intervals are compatible, i.e., if the conjunction is non-empty.
         
         Return 1 if non-empty, 0 if empty
         """
-        comp=1
-        min=self.intlist[:,1,:].max(axis=0)
-        max=self.intlist[:,0,:].min(axis=0)
-        if min.sum() >= 1 or max.sum() <= 1:
-            comp=0
-        for i in range(self.nbDecision):
-            if min[i] >= max[i]:
-                comp=0
-        return comp
+        maxlower,minupper=self._reduceBounds()
+        return areCompatibleBounds(maxlower,minupper,self.weights)
             
+    @_timedStage("conjunction")
     def conjunction(self):
         """Perform a conjunctive merging of the set of probability intervals
         
         Return a possibly non-proper intervalsProbability class object.
         """
-        if self.areCompatible() == 0:
+        maxlower,minupper=self._reduceBounds()
+        if areCompatibleBounds(maxlower,minupper,self.weights) == 0:
             raise Exception('Probability intervals not compatible, conjunction empty') 
-        fusedproba=np.zeros((2,self.nbDecision))
-        for i in range(self.nbDecision):
-            subset=np.ones(self.nbDecision)
-            subset[i]=0
-            lb=max(self.intlist[:,1,i].max(),1-self.intlist[:,0,subset[:]==1].min(axis=0).sum())
-            ub=min(self.intlist[:,0,i].min(),1-self.intlist[:,1,subset[:]==1].max(axis=0).sum())
-            fusedproba[1,i]=lb
-            fusedproba[0,i]=ub
-        result=intervalsProbability(fusedproba)
-        return result
+        return intervalsProbability(conjunctiveBounds(maxlower,minupper,self.weights),self.stats)
         
+    @_timedStage("disjunction")
     def disjunction(self):
         """Perform a disjunctive merging of the set of probability intervals
         
         Return an intervalsProbability class object.
         """
         fusedproba=np.zeros((2,self.nbDecision))
-        for i in range(self.nbDecision):
-            subset=np.ones(self.nbDecision)
-            subset[i]=0
-            lb=self.intlist[:,1,i].min()
-            ub=self.intlist[:,0,i].max()
-            fusedproba[1,i]=lb
-            fusedproba[0,i]=ub
-        result=intervalsProbability(fusedproba)
-        return result
+        fusedproba[1,:],fusedproba[0,:]=self._reduceBounds(conjunctive=False)
+        return intervalsProbability(fusedproba,self.stats)
         
     def getalmostMCS(self):
         """Internal function to get almost MCS probInt, in order to fusion them.
         
         Return the set of 'almost' MCS at the end"""
+        if self.maximal:
+            return [list(np.flatnonzero(MCS)) for MCS in self._getMaximalMasks()]
+        return [list(MCS) for MCS in self._getMCSMembers()]
+
+    def getMCSMasks(self):
+        """Compute the 'almost' MCS of the probability intervals, as boolean masks over them.
+
+        Sets of probability intervals are split element by element, according to the coherent subsets
+        of their bounds on this element, until they are compatible. By default, the sets are those of
+        the original sweep (see getMaxCoherentIntervals with touching), and are kept in the order they
+        are found (see getalmostMCS). With maximal, only the maximal coherent subsets are used, and
+        duplicated sets and sets included in other ones are removed at each step.
+
+        Return a kxm boolean array, the i-th row being True for the probability intervals in the i-th almost MCS,
+        the MCS being in the order of getalmostMCS (mask order, see maskOrder, with maximal).
+        """
+        if self.maximal:
+            return self._getMaximalMasks()
+        return self._membersMasks(self._getMCSMembers())
+
+    def _membersMasks(self,members):
+        """Internal function coding a list of arrays of indices of probability intervals as boolean masks.
+        """
+        masks=np.zeros((len(members),self.nbProbInt),dtype=bool)
+        for i in range(len(members)):
+            masks[i,members[i]]=True
+        return masks
+
+    @_timedStage("mcs")
+    def _getMCSMembers(self):
+        """Internal function computing the original 'almost' MCS, as arrays of indices.
+
+        The indices of a subset found on element j are sorted by lower bounds on j, as originally. A set
+        found several times at a step (same indices in the same order) is only split once, which does
+        not change the MCS: sets having the same indices in different orders may thus remain.
+
+        Return the list of index arrays, in the order the MCS are found.
+        """
         #Initialize MCS as all probability intervals
-        listofMCS=[range(self.nbProbInt)]
+        candidates=[np.arange(self.nbProbInt)]
+        compatible=[False]
         for j in range(self.nbDecision):
             temp_list=[]
-            for i in range(len(listofMCS)):
-                test=setOfIntProba(self.intlist[listofMCS[i],:,:])
-                if test.areCompatible() == 1:
-                    temp_list.append(listofMCS[i][:])
+            temp_compatible=[]
+            seen=set()
+            nbfound=0
+            for i in range(len(candidates)):
+                if compatible[i] or self._areCompatibleMembers(candidates[i]) == 1:
+                    found=[(candidates[i],True)]
                 else:
-                    MCS=getMaxCoherentIntervals(self.intlist[listofMCS[i][:],:,j].transpose())
-                    for l in range(len(MCS)):
-                        sub_MCS=[]
-                        for k in MCS[l]:
-                            sub_MCS.append(listofMCS[i][k])
-                        temp_list.append(sub_MCS[:])
-            listofMCS=temp_list[:]
-        listofMCS=[]
-        # elmminating redundant MCS
-        for elt in temp_list:
-            try:
-                ind=listofMCS.index(elt)
-            except:
-                listofMCS.append(elt)
-        return listofMCS
-            
-        
+                    found=[(candidates[i][MCS],False) for MCS in iterMaxCoherentIntervals(
+                        self._discounted(self.intlist[candidates[i],:,j].transpose()),touching=True)]
+                nbfound+=len(found)
+                for sub_MCS,subcompatible in found:
+                    key=sub_MCS.tostring()
+                    if key not in seen:
+                        seen.add(key)
+                        temp_list.append(sub_MCS)
+                        temp_compatible.append(subcompatible)
+            if self.stats is not None:
+                self.stats.count("candidates",nbfound)
+                self.stats.count("duplicates",nbfound-len(temp_list))
+            candidates=temp_list
+            compatible=temp_compatible
+        if self.stats is not None:
+            self.stats.count("mcs",len(candidates))
+            self.stats.record("mcssize",np.array([MCS.size for MCS in candidates]))
+        return candidates
+
+    @_timedStage("mcs")
+    def _getMaximalMasks(self):
+        """Internal function computing the maximal 'almost' MCS (see getMCSMasks), sorted in mask order.
+        """
+        #Initialize MCS as all probability intervals
+        candidates=np.ones((1,self.nbProbInt),dtype=bool)
+        compatible=np.zeros(1,dtype=bool)
+        for j in range(self.nbDecision):
+            temp_list=[]
+            temp_compatible=[]
+            for i in range(candidates.shape[0]):
+                if compatible[i] or self._areCompatibleMembers(np.flatnonzero(candidates[i])) == 1:
+                    temp_list.append(candidates[i])
+                    temp_compatible.append(True)
+                    continue
+                for sub_MCS in self._splitMembers(np.flatnonzero(candidates[i]),j):
+                    temp_list.append(sub_MCS)
+                    temp_compatible.append(False)
+            kept=keepMaximalSets(np.array(temp_list))
+            if self.stats is not None:
+                nbunique=len(set([sub_MCS.tostring() for sub_MCS in temp_list]))
+                self.stats.count("candidates",len(temp_list))
+                self.stats.count("duplicates",len(temp_list)-nbunique)
+                self.stats.count("subsumed",nbunique-kept.size)
+            candidates=np.array(temp_list)[kept]
+            compatible=np.array(temp_compatible)[kept]
+        if self.stats is not None:
+            self.stats.count("mcs",candidates.shape[0])
+            self.stats.record("mcssize",candidates.sum(axis=1))
+        return candidates[maskOrder(candidates)]
+
+    def getLargestMCS(self,nb):
+        """Compute the nb 'almost' MCS counting the most probability intervals, without computing the others.
+
+        Sets are explored best-first (largest first), a set being an upper bound of the size of the
+        'almost' MCS it can be split into. Between sets of equal sizes, the first one explored is the
+        first one found by getMCSMasks: sets are ranked by their split path (rank of the subset they
+        belong to at each element), which is the order in which getMCSMasks finds them. With maximal,
+        see _getLargestMaximalMasks.
+
+        Return a tuple (masks, sizes): a kxm boolean array coding the k<=nb largest 'almost' MCS
+        (largest first, then in the order of getMCSMasks) and the vector of their sizes.
+        """
+        if self.maximal:
+            return self._getLargestMaximalMasks(nb)
+        masks=self._membersMasks(self._getLargestMembers(nb))
+        return masks,masks.sum(axis=1)
+
+    @_timedStage("mcs")
+    def _getLargestMembers(self,nb):
+        """Internal function computing the nb largest original 'almost' MCS (see getLargestMCS), as
+        arrays of indices.
+        """
+        found=[]
+        foundkeys=set()
+        seen=set()
+        heap=[(-self.nbProbInt,(),np.arange(self.nbProbInt))]
+        while len(heap) > 0 and len(found) < nb:
+            negsize,path,members=heapq.heappop(heap)
+            j=len(path)
+            key=members.tostring()
+            # as in getMCSMasks, a set found several times at a step is only split once (first path)
+            if (key,j) in seen:
+                if self.stats is not None:
+                    self.stats.count("duplicates")
+                continue
+            seen.add((key,j))
+            if self.stats is not None:
+                self.stats.count("explored")
+            if j == self.nbDecision or self._areCompatibleMembers(members) == 1:
+                if key not in foundkeys:
+                    foundkeys.add(key)
+                    found.append(members)
+                continue
+            for rank,MCS in enumerate(iterMaxCoherentIntervals(
+                    self._discounted(self.intlist[members,:,j].transpose()),touching=True)):
+                heapq.heappush(heap,(-MCS.size,path+(rank,),members[MCS]))
+                if self.stats is not None:
+                    self.stats.count("candidates")
+        if self.stats is not None:
+            self.stats.count("mcs",len(found))
+            self.stats.record("mcssize",np.array([MCS.size for MCS in found]))
+        return found
+
+    @_timedStage("mcs")
+    def _getLargestMaximalMasks(self,nb):
+        """Internal function computing the nb largest maximal 'almost' MCS, without computing the others.
+
+        Sets are explored best-first (largest first), a set being an upper bound of the size of the
+        'almost' MCS it can be split into. Sets included in an already found MCS are not explored.
+        The exploration goes on while sets may still be split into MCS as large as the nb-th one, so
+        that ties are broken in mask order (see maskOrder), as in the results of getMCSMasks.
+        """
+        found=[]
+        seen=set()
+        heap=[(-self.nbProbInt,0,0,np.ones(self.nbProbInt,dtype=bool))]
+        counter=1
+        # MCS are found by decreasing size: stop when the next sets are smaller than the nb-th one
+        while len(heap) > 0 and (len(found) < nb or -heap[0][0] >= found[nb-1].sum()):
+            negsize,order,j,candidate=heapq.heappop(heap)
+            if len(found) > 0 and np.array(found)[:,candidate].all(axis=1).any():
+                if self.stats is not None:
+                    self.stats.count("pruned")
+                continue
+            if self.stats is not None:
+                self.stats.count("explored")
+            members=np.flatnonzero(candidate)
+            if j == self.nbDecision or self._areCompatibleMembers(members) == 1:
+                found.append(candidate)
+                continue
+            for sub_MCS in self._splitMembers(members,j):
+                size=sub_MCS.sum()
+                key=sub_MCS.tostring()
+                # a set left unsplit on element j goes on with the next element
+                if size == members.size or key not in seen:
+                    seen.add(key)
+                    heapq.heappush(heap,(-size,counter,j+1,sub_MCS))
+                    counter+=1
+                    if self.stats is not None:
+                        self.stats.count("candidates")
+        masks=np.array(found,dtype=bool).reshape(len(found),self.nbProbInt)
+        masks=masks[maskOrder(masks,masks.sum(axis=1))[:nb]]
+        if self.stats is not None:
+            self.stats.count("mcs",masks.shape[0])
+            self.stats.record("mcssize",masks.sum(axis=1))
+        return masks,masks.sum(axis=1)
+
+    def _areCompatibleMembers(self,members):
+        """Internal function checking whether a subset of the probability intervals are compatible.
+        """
+        maxlower,minupper=self._reduceBounds(members)
+        return areCompatibleBounds(maxlower,minupper,self.weights)
+
+    def _splitMembers(self,members,j):
+        """Internal function splitting a subset of the probability intervals into the maximal coherent
+        subsets of their bounds on element j, returned as boolean masks.
+        """
+        for MCS in iterMaxCoherentIntervals(self._discounted(self.intlist[members,:,j].transpose())):
+            sub_MCS=np.zeros(self.nbProbInt,dtype=bool)
+            sub_MCS[members[MCS]]=True
+            yield sub_MCS
+
     def almostMCScomb(self):
         """get a list of 'almost' MCS and perform a combination according to it.
         
         Return a proper probability intervals"""
-        list=self.getalmostMCS()
-        nbMCS=len(list)
-        conj=[]
-        setofdisj=[]
-        for i in range(nbMCS):
-            setofprob=setOfIntProba(self.intlist[list[i],:,:])
-            if setofprob.areCompatible() == 0:
-                setofprob.discountnoncomp()
-            conj=setofprob.conjunction()
-            resconj=np.array([conj.lproba[0,:],conj.lproba[1,:]])
-            setofdisj.append(resconj)
-        setofprob2=setOfIntProba(np.array(setofdisj))
-        return setofprob2.disjunction()
-            
+        return self.runCombinations(["almostMCScomb"])["almostMCScomb"]
         
     def mostMCSconj(self):
         """get a list of 'almost' MCS and perform a conjunctive combination on the MCS
-        counting the most elements (in case of ties, first one is chosen)
+        counting the most elements (in case of ties, first one is chosen, i.e. the first one of
+        getalmostMCS, see getLargestMCS)
         
         Return a proper probability intervals
         """
-        list=self.getalmostMCS()
-        nbMCS=len(list)
-        nbsetinMCS=np.zeros(nbMCS)
-        for i in range(nbMCS):
-            nbsetinMCS[i]=len(list[i])
-        setofprob=setOfIntProba(self.intlist[list[nbsetinMCS.argmax()],:,:])
-        if setofprob.areCompatible() == 0:
-            setofprob.discountnoncomp()
-        return setofprob.conjunction()
+        return self.runCombinations(["mostMCSconj"])["mostMCSconj"]
         
     def bestfirstMCS(self,nb):
-        """return the MCS that counts the n sets counting the most objects. 
-        """
-        list=self.getalmostMCS()
-        nbMCS=len(list)
-        nbsetinMCS=np.zeros(nbMCS)
-        setofdisj=[]
-        for i in range(nbMCS):
-            nbsetinMCS[i]=len(list[i])
-        best=np.argsort(nbsetinMCS)[::-1]
-        if nb > nbMCS:
-            nb=nbMCS
-        for i in range(nb):
-            setofprob=setOfIntProba(self.intlist[list[best[i]],:,:])
-            if setofprob.areCompatible() == 0:
-                setofprob.discountnoncomp()
-            conj=setofprob.conjunction()
-            resconj=np.array([conj.lproba[0,:],conj.lproba[1,:]])
-            setofdisj.append(resconj)
-        setofprob2=setOfIntProba(np.array(setofdisj))
-        return setofprob2.disjunction()
-       
+        """return the MCS that counts the n sets counting the most objects 
+        (ties ranked as originally by the reversed argsort of the sizes, in mask order with maximal).
+        """
+        return self.runCombinations(["bestfirstMCS"],nb)["bestfirstMCS"]
         
     def meanfirstMCSweighted(self,nb):
-        """return the mean of MCS that counts the n sets counting the most objects. 
-        """
-        list=self.getalmostMCS()
-        nbMCS=len(list)
-        nbsetinMCS=np.zeros(nbMCS)
-        setofmean=[]
-        for i in range(nbMCS):
-            nbsetinMCS[i]=len(list[i])
-        best=np.argsort(nbsetinMCS)[::-1]
-        if nb > nbMCS:
-            nb=nbMCS
-        sumMCS=nbsetinMCS[best[range(nb)]].sum()
-        for i in range(nb):
-            setofprob=setOfIntProba(self.intlist[list[best[i]],:,:])
-            if setofprob.areCompatible() == 0:
-                setofprob.discountnoncomp()
-            conj=setofprob.conjunction()
-            resconj=np.array([conj.lproba[0,:],conj.lproba[1,:]])
-            if i==0:
-                resconjweighted=(nbsetinMCS[best[i]]/sumMCS)*resconj
-            else:
-                resconjweighted+=(nbsetinMCS[best[i]]/sumMCS)*resconj
-        return intervalsProbability(resconjweighted)
+        """return the mean of MCS that counts the n sets counting the most objects 
+        (ties ranked as originally by the reversed argsort of the sizes, in mask order with maximal).
+        """
+        return self.runCombinations(["meanfirstMCSweighted"],nb)["meanfirstMCSweighted"]
     
     def runCombination(self, combname, n=5):
-        resultingcomb=[];
-        if combname=="mostMCSconj":
-            resultingcomb=self.mostMCSconj()
-        if combname=="almostMCScomb":
-            resultingcomb=self.almostMCScomb()
-        if combname=="bestfirstMCS":
-            resultingcomb=self.bestfirstMCS(n)
-        if combname=="meanfirstMCSweighted":
-            resultingcomb=self.meanfirstMCSweighted(n)
-        return resultingcomb
+        return self.runCombinations([combname],n).get(combname,[])
+
+    @_timedStage("combination")
+    def runCombinations(self, combnames, n=5):
+        """Perform several combinations, sharing the computation of the 'almost' MCS and of their conjunctions.
+
+        Argument:
+        combnames -- a list of combination names among almostMCScomb, mostMCSconj, bestfirstMCS and meanfirstMCSweighted
+        n -- number of MCS used by bestfirstMCS and meanfirstMCSweighted
+
+        Return a dictionary giving the resulting intervalsProbability of each (known) combination name.
+        """
+        results={}
+        conjunctions={}
+        largest="bestfirstMCS" in combnames or "meanfirstMCSweighted" in combnames
+        # the MCS are computed once: the largest ones are taken among them when they are all needed
+        if "almostMCScomb" in combnames or (largest and not self.maximal):
+            masks=self.getMCSMasks()
+            sizes=masks.sum(axis=1)
+            if "almostMCScomb" in combnames:
+                setofdisj=[self._conjunctionMCS(masks[i],conjunctions) for i in range(masks.shape[0])]
+                results["almostMCScomb"]=setOfIntProba(np.array(setofdisj),self.stats).disjunction()
+            if self.maximal:
+                # as getLargestMCS: largest first, then in mask order
+                best=maskOrder(masks,sizes)
+                most=best[0]
+            else:
+                # largest MCS ranked as originally: first largest one, reversed argsort of the sizes
+                best=np.argsort(sizes)[::-1]
+                most=sizes.argmax()
+        elif "mostMCSconj" in combnames or largest:
+            masks,sizes=self.getLargestMCS(max(n,1) if largest else 1)
+            best=np.arange(sizes.size)
+            most=0
+        else:
+            return results
+        mostconj=self._conjunctionMCS(masks[most],conjunctions) if "mostMCSconj" in combnames else None
+        best=best[:n] if largest else best[:0]
+        setofconj=[self._conjunctionMCS(masks[i],conjunctions) for i in best]
+        results.update(_largestCombinations(combnames,mostconj,setofconj,sizes[best],self.stats))
+        return results
+
+    def _conjunctionMCS(self,mask,conjunctions):
+        """Internal function computing (and storing in conjunctions) the conjunction of the probability
+        intervals coded by mask, discounted if they are not compatible.
+
+        Return a 2xn array containing upper (1st row) and lower (2nd row) bounds
+        """
+        key=mask.tostring()
+        if key not in conjunctions:
+            conjunctions[key]=self._conjunctionMembers(np.flatnonzero(mask))
+        return conjunctions[key]
+
+    @_timedStage("conjunction")
+    def _conjunctionMembers(self,members):
+        """Internal function computing the conjunction of a subset of the probability intervals,
+        discounted if they are not compatible, without copying their bounds.
+        """
+        maxlower,minupper=self._reduceBounds(members)
+        if areCompatibleBounds(maxlower,minupper,self.weights) == 0:
+            discount=self._getDiscount(maxlower,minupper)
+            maxlower=maxlower*discount
+            minupper=minupper*discount+(1-discount)
+            if areCompatibleBounds(maxlower,minupper,self.weights) == 0:
+                raise Exception('Probability intervals not compatible, conjunction empty')
+        return conjunctiveBounds(maxlower,minupper,self.weights)
 
         
     def discountnoncomp(self):
-        """return set of discounted probability intervals if they are not compatible
+        """Discount the set of probability intervals if they are not compatible
+
+        The bounds are not modified: the discount factor is multiplied into discount, and applied
+        when bounds are read (see getIntervals).
+        """
+        self.discount*=self._getDiscount(*self._reduceBounds())
+
+    @_timedStage("discount")
+    def _getDiscount(self,maxlower,minupper):
+        """Internal function computing the discount factor making compatible probability intervals,
+        given their highest lower and lowest upper bounds.
         """
-        min=self.intlist[:,1,:].max(axis=0)
-        max=self.intlist[:,0,:].min(axis=0)
         epsilon_l=1.
         epsilon_u=1.
-        if self.areCompatible() == 0:
-            if min.sum() - 1 > 0:
-                epsilon_l=1./min.sum()
-            if max.sum() - 1 < 0:
-                epsilon_u=(1.-self.nbDecision)/(max.sum()-self.nbDecision)
+        if areCompatibleBounds(maxlower,minupper,self.weights) == 0:
+            lowsum=weightedSum(maxlower,self.weights)
+            upsum=weightedSum(minupper,self.weights)
+            if lowsum - 1 > 0:
+                epsilon_l=1./lowsum
+            if upsum - 1 < 0:
+                epsilon_u=(1.-self.nbElements)/(upsum-self.nbElements)
         if epsilon_l < epsilon_u:
             discount=epsilon_l*0.99
         else:
             discount=epsilon_u*0.99
-        self.intlist[:,1,:]=self.intlist[:,1,:]*discount
-        self.intlist[:,0,:]=self.intlist[:,0,:]*discount+(1-discount)
+        if self.stats is not None:
+            self.stats.count("discounted")
+            self.stats.record("discount",discount)
+        return discount
+
+def _largestCombinations(combnames,mostconj,setofconj,nbsetinMCS,stats):
+    """Internal function performing the combinations mostMCSconj, bestfirstMCS and meanfirstMCSweighted,
+    given the conjunction of the MCS chosen by mostMCSconj, and the conjunctions of the n largest
+    MCS (ranked) and their sizes.
+    """
+    results={}
+    if "mostMCSconj" in combnames:
+        results["mostMCSconj"]=intervalsProbability(mostconj.copy(),stats)
+    if "bestfirstMCS" in combnames:
+        results["bestfirstMCS"]=setOfIntProba(np.array(setofconj),stats).disjunction()
+    if "meanfirstMCSweighted" in combnames:
+        weights=nbsetinMCS/float(nbsetinMCS.sum())
+        resconjweighted=(weights[:,np.newaxis,np.newaxis]*np.array(setofconj)).sum(axis=0)
+        results["meanfirstMCSweighted"]=intervalsProbability(resconjweighted,stats)
+    return results
+
+def memmapSetOfIntProba(filename,stats=None,chunksize=None,maximal=False):
+    """Open a set of probability intervals stored in a .npy file, without loading it in memory
+
+    Argument:
+    filename -- a .npy file containing a mx2xn array (e.g. written by numpy.save, or filled
+                through numpy.lib.format.open_memmap for stacks larger than memory)
+    stats, chunksize, maximal -- see setOfIntProba
+
+    Return a setOfIntProba whose bounds are a read-only memmap of the file.
+    """
+    return setOfIntProba(np.load(filename,mmap_mode='r'),stats,chunksize,maximal=maximal)
+
+class incrementalSetOfIntProba:
+    """Class of a set of probability intervals whose sources are added and removed one at a time,
+    the 'almost' MCS being updated rather than recomputed
+
+    Argument:
+    nbDecision -- size of the frame
+    stats -- optional fusionStats (see setOfIntProba)
+    cachesize -- maximal number of splits remembered
+
+    The maximal 'almost' MCS are computed element by element as by setOfIntProba with maximal. The
+    split of a set of sources on element j only depends on this set and on j: it is stored in a
+    fusionCache. After an update, the split is done again from all the sources, but only the sets
+    containing the added (or having contained the removed) source are split again, the others being
+    found in the cache. Since duplicated and subsumed sets are removed at each step, only the sets
+    of the pruned splits are stored. Conjunctions of MCS are also kept from one update to the next.
+
+    MCS are the same as those of setOfIntProba with maximal on the current sources (in the order
+    they were added), and are sorted in the same (mask) order, so that combinations give the same
+    results.
+    """
+
+    def __init__(self,nbDecision,stats=None,cachesize=100000):
+        self.nbDecision=nbDecision
+        self.stats=stats
+        self.splits=fusionCache(cachesize)
+        self.conjunctions={}
+        # bounds of the sources are stored in slots, removed sources leaving free slots until compaction
+        self.bounds=np.zeros((16,2,nbDecision))
+        self.alive=np.zeros(16,dtype=bool)
+        self.nbSlots=0
+        self.slots={}
+        self.sources=[]
+        self.nextSource=0
+        self.mcs=None
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self,lproba):
+        """Add the probability intervals of a source
+
+        Argument:
+        lproba -- a 2xn array containing upper (1st row) and lower (2nd row) bounds
+
+        Return the identifier of the source (used to remove it).
+        """
+        if lproba.__class__.__name__ != 'ndarray':
+            raise Exception('Expecting a numpy array as argument')
+        if lproba.shape != (2,self.nbDecision):
+            raise Exception('Bounds incompatible with the frame size')
+        if self.nbSlots == self.alive.size:
+            self.bounds=np.concatenate((self.bounds,np.zeros(self.bounds.shape)))
+            self.alive=np.concatenate((self.alive,np.zeros(self.alive.size,dtype=bool)))
+        self.bounds[self.nbSlots]=lproba
+        self.alive[self.nbSlots]=True
+        source=self.nextSource
+        self.slots[source]=self.nbSlots
+        self.sources.append(source)
+        self.nbSlots+=1
+        self.nextSource+=1
+        self.mcs=None
+        return source
+
+    def remove(self,source):
+        """Remove the probability intervals of a source, given its identifier
+        """
+        if source not in self.slots:
+            raise Exception('Unknown source: %s' % source)
+        self.alive[self.slots.pop(source)]=False
+        self.sources.remove(source)
+        self.mcs=None
+        if self.nbSlots > 64 and self.nbSlots > 2*len(self.slots):
+            self._compact()
+
+    def _compact(self):
+        """Internal function moving the sources to the first slots, forgetting the stored splits.
+        """
+        kept=np.flatnonzero(self.alive[:self.nbSlots])
+        self.bounds[:kept.size]=self.bounds[kept]
+        self.alive[:]=False
+        self.alive[:kept.size]=True
+        newslot=dict((slot,i) for i,slot in enumerate(kept))
+        for source in self.slots:
+            self.slots[source]=newslot[self.slots[source]]
+        self.nbSlots=kept.size
+        self.splits.clear()
+        self.conjunctions={}
+
+    def getIntervals(self):
+        """Return the mx2xn array of the bounds of the current sources (in the order they were added)
+        """
+        return self.bounds[[self.slots[source] for source in self.sources]]
+
+    def getSetOfIntProba(self):
+        """Return a setOfIntProba (with maximal) of the current sources (in the order they were added)
+        """
+        return setOfIntProba(self.getIntervals(),self.stats,maximal=True)
+
+    def _key(self,mask):
+        """Internal function coding a boolean mask over slots as a string, whatever the number of slots.
+        """
+        return np.packbits(mask).tostring().rstrip(b'\x00')
+
+    def _mask(self,key):
+        """Internal function decoding a string coded by _key into a boolean mask over slots.
+        """
+        return self._masks([key])[0]
+
+    def _masks(self,keys):
+        """Internal function decoding a list of strings coded by _key into a boolean array (one row per key).
+        """
+        nbbytes=(self.nbSlots+7)//8
+        packed=np.frombuffer(b''.join([key.ljust(nbbytes,b'\x00') for key in keys]),dtype=np.uint8)
+        return np.unpackbits(packed.reshape(len(keys),nbbytes),axis=1)[:,:self.nbSlots].astype(bool)
+
+    def _split(self,store,key,j):
+        """Internal function splitting a set of sources (coded by _key) on element j, as done at each
+        step by setOfIntProba with maximal.
+
+        Return a tuple of pairs (key, compatible): the set itself if its sources are compatible, else
+        the maximal coherent subsets of their bounds on element j.
+        """
+        found=self.splits.get((key,j))
+        if found is None:
+            members=np.flatnonzero(self._mask(key))
+            if store._areCompatibleMembers(members) == 1:
+                found=((key,True),)
+            else:
+                found=[]
+                for MCS in iterMaxCoherentIntervals(self.bounds[members,:,j].transpose()):
+                    mask=np.zeros(self.nbSlots,dtype=bool)
+                    mask[members[MCS]]=True
+                    found.append((self._key(mask),False))
+                found=tuple(found)
+            self.splits.put((key,j),found)
+        return found
+
+    @_timedStage("mcs")
+    def _refresh(self):
+        """Internal function updating the 'almost' MCS (keys, masks and sizes) after changes of sources.
+        """
+        if self.mcs is None:
+            if len(self.slots) == 0:
+                raise Exception('No probability intervals added')
+            store=setOfIntProba(self.bounds[:self.nbSlots])
+            candidates=[(self._key(self.alive[:self.nbSlots]),False)]
+            for j in range(self.nbDecision):
+                temp_list=[]
+                for key,compatible in candidates:
+                    if compatible:
+                        temp_list.append((key,True))
+                    else:
+                        temp_list.extend(self._split(store,key,j))
+                unique=OrderedDict()
+                for key,compatible in temp_list:
+                    unique.setdefault(key,compatible)
+                keys=list(unique)
+                kept=keepMaximalSets(self._masks(keys))
+                if self.stats is not None:
+                    self.stats.count("candidates",len(temp_list))
+                    self.stats.count("duplicates",len(temp_list)-len(keys))
+                    self.stats.count("subsumed",len(keys)-kept.size)
+                candidates=[(keys[i],unique[keys[i]]) for i in kept]
+            keys=[key for key,compatible in candidates]
+            masks=self._masks(keys)
+            # slots are in the order sources were added: mask order is the one of setOfIntProba
+            order=maskOrder(masks)
+            keys=[keys[i] for i in order]
+            masks=masks[order]
+            self.mcs=(keys,masks,masks.sum(axis=1))
+            if self.stats is not None:
+                self.stats.count("mcs",len(keys))
+                self.stats.record("mcssize",self.mcs[2])
+        return self.mcs
+
+    def getalmostMCS(self):
+        """Return the 'almost' MCS of the current sources, as lists of source identifiers
+        """
+        keys,masks,sizes=self._refresh()
+        slotsources=dict((slot,source) for source,slot in self.slots.items())
+        return [[slotsources[slot] for slot in np.flatnonzero(mask)] for mask in masks]
+
+    @_timedStage("combination")
+    def runCombinations(self, combnames, n=5):
+        """Perform several combinations of the current sources (see setOfIntProba.runCombinations),
+        only computing the conjunctions of MCS that changed since the last call.
+
+        Return a dictionary giving the resulting intervalsProbability of each (known) combination name.
+        """
+        keys,masks,sizes=self._refresh()
+        store=setOfIntProba(self.bounds[:self.nbSlots],self.stats)
+        conjunctions={}
+        for i in range(len(keys)):
+            if keys[i] in self.conjunctions:
+                conjunctions[keys[i]]=self.conjunctions[keys[i]]
+            else:
+                conjunctions[keys[i]]=store._conjunctionMembers(np.flatnonzero(masks[i]))
+        self.conjunctions=conjunctions
+        setofconj=[conjunctions[key] for key in keys]
+        results={}
+        if "almostMCScomb" in combnames:
+            results["almostMCScomb"]=setOfIntProba(np.array(setofconj),self.stats).disjunction()
+        order=maskOrder(masks,sizes)[:n]
+        results.update(_largestCombinations(combnames,setofconj[order[0]],[setofconj[i] for i in order],sizes[order],self.stats))
+        return results
+
+    def runCombination(self, combname, n=5):
+        return self.runCombinations([combname],n).get(combname,[])
 
 if __name__=='__main__':
     #lproba =np.array([[0.4,0.4,0.5],[0.2,0,0.2]])
@@ -422,16 +1422,10 @@ if __name__=='__main__':
     #print essai.getUpperProbability(np.array([1,0,1]))
     #essai.printProbability()
     
-    #setproba=np.array([[[0.6,0.5,0.2],[0.4,0.3,0.]],[[0.55,0.55,0.2],[0.35,0.35,0.]],
-    #                [[0.5,0.2,0.6],[0.3,0.,0.4]],[[0.35,0.6,0.35],[0.15,0.4,0.15]]])
-    #test=setOfIntProba(setproba)
-    #test.areCompatible()
-    #test.getalmostMCS()
-   
-    data=Orange.data.Table("audiology") # data.domain, len(data)=> nb instance, len(data.domain)=> nb attribut
-    indices = Orange.data.sample.SubsetIndices2(p0=0.25) # 
-    ind=indices(data)
-    iristr = data.select(ind, 0) # ind=>vect de bool de taille du nb d'instance, 0=> prendre tous les indices
-    iristst = data.select(ind, 1) # 1=> prendre l'inverse des indices
-    test_forest(iristr,iristst)
-
+    setproba=np.array([[[0.6,0.5,0.2],[0.4,0.3,0.]],[[0.55,0.55,0.2],[0.35,0.35,0.]],
+                    [[0.5,0.2,0.6],[0.3,0.,0.4]],[[0.35,0.6,0.35],[0.15,0.4,0.15]]])
+    test=setOfIntProba(setproba)
+    print test.getalmostMCS()
+    for combname in ["almostMCScomb","mostMCSconj","bestfirstMCS","meanfirstMCSweighted"]:
+        print combname
+        test.runCombination(combname).printProbability()
@@ -2,7 +2,9 @@ import numpy as np
 import Orange
 import orngTree, orngEnsemble
 from intervalsProbability import *
-import random
+from fusionCache import fusionCache
+from parallelFusion import fuseLeaves, fusionAccuracies
+from orangeForest import forestIntervals, trainForest, trueClasses
 import time as t
 
 def test_simpleTree(training, test):
@@ -21,63 +23,42 @@ def test_simpleTree(training, test):
 
     return acc,t.time()-start
 
-def test_forestFusion(training,test,combMethod,nbTree=15):
+def test_forestFusion(training,test,combMethod,nbTree=15,cache=None,nbProcesses=1):
     """Function that takes a training and test data sets, build forests and return decisions
+
+    combMethod is either a combination name, or a list of names: the forest is then built and
+    descended once, all combinations being obtained from the same MCS, and a dictionary giving
+    the results of each combination name is returned.
+
+    Fused intervals are stored in cache (a fusionCache, emptied as the forest is new), keyed by
+    the indices of the leaves reached in each tree, so that test instances reaching the same leaves
+    are fused once. With nbProcesses > 1, fusions are split among processes (see parallelFusion).
     """
     start = t.time()
 
     s=4
-    accuracy=0.
-    set_accuracy=0.
-    disc_accuracy=0.
+    if isinstance(combMethod,str):
+        combMethods=[combMethod]
+    else:
+        combMethods=combMethod
+    if cache is None:
+        cache=fusionCache()
+    cache.clear()
     nb_classes=len(test.domain.class_var.values)
-    tree_learn = Orange.classification.tree.TreeLearner(minExamples=2, mForPrunning=2, 
-                            sameMajorityPruning=True, name='tree')
-    forest = Orange.ensemble.forest.RandomForestLearner(trees=nbTree, base_learner=tree_learn,rand=random.Random(0))
-    result = forest(training)
+    result = trainForest(training,nbTree)
  
-    for j in range(len(test)):
-        setofprob=[]
-        for i in range(len(result.classifiers)):
-            low=np.zeros(nb_classes)
-            up=np.zeros(nb_classes)
-            answer=result.classifiers[i].descender(result.classifiers[i].tree,test[j])
-            divide=sum(answer[0].distribution)+s
-            for k in range(nb_classes):
-                low[k]=(answer[0].distribution[k])/divide
-                up[k]=(answer[0].distribution[k]+s)/divide
-            prob=np.array([up,low])
-            setofprob.append(prob[:])
-        
-        resultingset=setOfIntProba(np.array(setofprob))
-        #resultingcomb=resultingset.almostMCScomb()
-        #resultingcomb=resultingset.mostMCSconj()
-        #resultingcomb=resultingset.bestfirstMCS(1)
-        #resultingcomb=resultingset.meanfirstMCSweighted(5)
-        resultingcomb=resultingset.runCombination(combMethod)
-        decision=resultingcomb.nc_hurwicz_decision(0.5)   
-        if test[j].getclass()==test.domain.class_var.values[decision]:
-            accuracy=accuracy+1
-
-        decision_max=resultingcomb.nc_maximal_decision() 
-
-        true_class=np.zeros(nb_classes)
-        for k in range(nb_classes):
-            if test[j].getclass()==test.domain.class_var.values[k]:
-                true_class[k]=1
-   
-        if any(np.minimum(decision_max,true_class)==1):
-            set_accuracy=set_accuracy+1
-            disc_accuracy=disc_accuracy+(1./decision_max.sum())
-          
-
-    accuracy=accuracy/len(test)
-    set_accuracy=set_accuracy/len(test)
-    disc_accuracy=disc_accuracy/len(test)
-    
-    return accuracy, set_accuracy, disc_accuracy, t.time()-start
-
-
+    intervals=forestIntervals(result,nb_classes,s)
+    leaves=intervals.getLeaves(test)
+    fusedproba=fuseLeaves(intervals.bounds,leaves,combMethods,cache,nbProcesses)
+
+    true_class=trueClasses(test)
+    results={}
+    for method in combMethods:
+        accuracy, set_accuracy, disc_accuracy=fusionAccuracies(fusedproba[method],true_class)
+        results[method]=(accuracy, set_accuracy, disc_accuracy, t.time()-start)
+    if isinstance(combMethod,str):
+        return results[combMethod]
+    return results
 
 def test_forestVote(training,test,nbTree=15):
     """Function that takes a training and test data sets, build forests and return decisions
@@ -86,10 +67,7 @@ def test_forestVote(training,test,nbTree=15):
 
     accuracy=0.
     nb_classes=len(test.domain.class_var.values)
-    tree_learn = Orange.classification.tree.TreeLearner(minExamples=2, mForPrunning=2, 
-                            sameMajorityPruning=True, name='tree')
-    forest = Orange.ensemble.forest.RandomForestLearner(trees=nbTree, base_learner=tree_learn,rand=random.Random(0))    
-    result = forest(training)
+    result = trainForest(training,nbTree)
 
     for i in range(len(test)):
         y=result(test[i],Orange.classification.Classifier.GetValue)
@@ -123,10 +101,11 @@ if __name__=='__main__':
  
     for iTree in range(0,len(nbTree)):
         prec,tpsst=test_simpleTree(iristr,iristst)
-        [accAlmost, set_accAlmost, disc_accAlmost,tpsffAlmost]=test_forestFusion(iristr,iristst,"almostMCScomb",nbTree[iTree])
-        [accConj, set_accConj, disc_accConj,tpsffConj]=test_forestFusion(iristr,iristst,"mostMCSconj",nbTree[iTree])
-        [accBFirst, set_accBFirst, disc_accBFirst,tpsffBFirst]=test_forestFusion(iristr,iristst,"bestfirstMCS",nbTree[iTree])
-        [accMFirst, set_accMFirst, disc_accMFirst,tpsffMFirst]=test_forestFusion(iristr,iristst,"meanfirstMCSweighted",nbTree[iTree])
+        fusion=test_forestFusion(iristr,iristst,["almostMCScomb","mostMCSconj","bestfirstMCS","meanfirstMCSweighted"],nbTree[iTree])
+        [accAlmost, set_accAlmost, disc_accAlmost,tpsffAlmost]=fusion["almostMCScomb"]
+        [accConj, set_accConj, disc_accConj,tpsffConj]=fusion["mostMCSconj"]
+        [accBFirst, set_accBFirst, disc_accBFirst,tpsffBFirst]=fusion["bestfirstMCS"]
+        [accMFirst, set_accMFirst, disc_accMFirst,tpsffMFirst]=fusion["meanfirstMCSweighted"]
         accVote,tpsfv=test_forestVote(iristr,iristst,nbTree[iTree])
 
         print " & %d" %nbTree[iTree] ," & %.2f " %prec, " & %.2f " %accVote, " & %.2f " %disc_accConj, " & %.2f "  %set_accConj, " & %.2f" %accConj, " & %.2f " %disc_accAlmost, " & %.2f "  %set_accAlmost, " & %.2f" %accAlmost, " & %.2f " %disc_accBFirst, " & %.2f "  %set_accBFirst, " & %.2f" %accBFirst, " & %.2f " %disc_accMFirst, " & %.2f "  %set_accMFirst, " & %.2f" %accMFirst, "\\\\"
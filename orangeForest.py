@@ -0,0 +1,178 @@
+import itertools
+import multiprocessing
+import random
+import numpy as np
+import Orange
+from intervalsProbability import intervalsProbability
+from fusionCache import fusionCache
+from parallelFusion import COMBINATIONS, fuseLeaves, fusionDecisions
+
+class forestIntervals:
+    """Class of the probability intervals of all the nodes of the trees of a forest
+
+    Argument:
+    forest -- a forest classifier (e.g. obtained from Orange.ensemble.forest.RandomForestLearner)
+    nb_classes -- number of classes
+    s -- parameter of the imprecise Dirichlet model used to get intervals from class counts
+
+    Bounds of all the nodes are computed once and stored in a Lx2xn array (bounds), so that the
+    probability intervals of test instances are obtained by gathering rows of this array.
+    """
+
+    def __init__(self,forest,nb_classes,s=4):
+        self.classifiers=forest.classifiers
+        self.nbTree=len(self.classifiers)
+        self.nbDecision=nb_classes
+        self.s=s
+        # nodes are kept, so that their ids identify them
+        self.nodes=[]
+        self.nodeIndex={}
+        counts=[]
+        for classifier in self.classifiers:
+            tovisit=[classifier.tree]
+            while len(tovisit) > 0:
+                node=tovisit.pop()
+                counts.append(self._registerNode(node))
+                if node.branches:
+                    tovisit.extend([branch for branch in node.branches if branch is not None])
+        self.bounds=self._getBounds(np.array(counts).reshape(len(counts),nb_classes))
+        self.newcounts=[]
+
+    def _registerNode(self,node):
+        """Internal function giving an index to a node and returning its class counts.
+        """
+        self.nodeIndex[id(node)]=len(self.nodes)
+        self.nodes.append(node)
+        return [node.distribution[k] for k in range(self.nbDecision)]
+
+    def _getBounds(self,counts):
+        """Internal function computing the imprecise Dirichlet bounds from a Lxn array of class counts.
+        """
+        bounds=np.zeros((counts.shape[0],2,self.nbDecision))
+        divide=counts.sum(axis=1)[:,np.newaxis]+self.s
+        bounds[:,1,:]=counts/divide
+        bounds[:,0,:]=(counts+self.s)/divide
+        return bounds
+
+    def getLeaves(self,instances):
+        """Return the Nxm array of the indices of the nodes reached by the N instances in the m trees.
+        """
+        leaves=np.zeros((len(instances),self.nbTree),dtype=int)
+        for j in range(len(instances)):
+            for i in range(self.nbTree):
+                node=self.classifiers[i].descender(self.classifiers[i].tree,instances[j])[0]
+                if id(node) not in self.nodeIndex:
+                    # nodes not met when visiting the trees are added on the fly
+                    self.newcounts.append(self._registerNode(node))
+                leaves[j,i]=self.nodeIndex[id(node)]
+        if len(self.newcounts) > 0:
+            newcounts=np.array(self.newcounts).reshape(len(self.newcounts),self.nbDecision)
+            self.bounds=np.concatenate((self.bounds,self._getBounds(newcounts)))
+            self.newcounts=[]
+        return leaves
+
+    def getIntervals(self,leaves):
+        """Return the Nxmx2xn array of the probability intervals of nodes, given their Nxm array of indices.
+        """
+        return self.bounds[leaves]
+
+def trainForest(training,nbTree=15):
+    """Function that takes a training data set and return the random forest used in experiments
+    """
+    tree_learn = Orange.classification.tree.TreeLearner(minExamples=2, mForPrunning=2, 
+                            sameMajorityPruning=True, name='tree')
+    forest = Orange.ensemble.forest.RandomForestLearner(trees=nbTree, base_learner=tree_learn,rand=random.Random(0))
+    return forest(training)
+
+def trueClasses(test):
+    """Function that takes a test data set and return the Nxn 0/1 array of the true classes of instances
+    """
+    nb_classes=len(test.domain.class_var.values)
+    true_class=np.zeros((len(test),nb_classes))
+    for j in range(len(test)):
+        for k in range(nb_classes):
+            if test[j].getclass()==test.domain.class_var.values[k]:
+                true_class[j,k]=1
+    return true_class
+
+class forestFusionClassifier:
+    """Class of a classifier fusing the probability intervals given by the trees of a random forest
+
+    Argument:
+    combMethod -- combination name (see setOfIntProba.runCombinations)
+    nbTree -- number of trees of the forest
+    s -- parameter of the imprecise Dirichlet model
+    alpha -- hurwicz parameter
+    chunksize -- number of instances whose leaves are looked up and fused at once
+    cache -- a fusionCache of fused intervals (default: a new one), emptied when fitting
+    nbProcesses -- number of processes fusing the intervals of a chunk
+
+    Instances are predicted by chunks: memory does not depend on the number of instances, and a
+    prediction is yielded as soon as its chunk is done (chunksize=1 gives the lowest latency).
+    With nbProcesses > 1, the worker processes are started by the first prediction and used for
+    all the following chunks (see poolFusion), until close is called.
+    """
+
+    def __init__(self,combMethod="almostMCScomb",nbTree=15,s=4,alpha=0.5,chunksize=64,cache=None,nbProcesses=1):
+        if combMethod not in COMBINATIONS:
+            raise Exception('Unknown combination: %s' % combMethod)
+        if chunksize < 1:
+            raise Exception('Chunk size should be at least 1')
+        self.combMethod=combMethod
+        self.nbTree=nbTree
+        self.s=s
+        self.alpha=alpha
+        self.chunksize=chunksize
+        self.cache=fusionCache() if cache is None else cache
+        self.nbProcesses=nbProcesses
+        self.pool=None
+        self.forest=None
+        self.intervals=None
+
+    def fit(self,training):
+        """Train the forest on a training data set and compute the intervals of its nodes
+
+        Return the classifier itself.
+        """
+        self.forest=trainForest(training,self.nbTree)
+        self.intervals=forestIntervals(self.forest,len(training.domain.class_var.values),self.s)
+        self.cache.clear()
+        return self
+
+    def predict(self,instances):
+        """Predict instances, read from any iterable (e.g. a data table or a stream)
+
+        Yield, for each instance, a tuple (fused, hurwicz, maximal) of its fused intervalsProbability,
+        of its hurwicz decision and of the boolean vector of its maximal decisions.
+        """
+        if self.intervals is None:
+            raise Exception('Classifier not fitted')
+        iterator=iter(instances)
+        while True:
+            chunk=list(itertools.islice(iterator,self.chunksize))
+            if len(chunk) == 0:
+                return
+            for prediction in zip(*self.predictChunk(chunk)):
+                yield prediction
+
+    def predictChunk(self,chunk):
+        """Predict a list of instances at once
+
+        Return a tuple (fused, hurwicz, maximal) of the list of fused intervalsProbability, of the
+        vector of hurwicz decisions and of the array of maximal decisions (one row per instance).
+        """
+        leaves=self.intervals.getLeaves(chunk)
+        if self.nbProcesses > 1 and self.pool is None:
+            self.pool=multiprocessing.Pool(self.nbProcesses)
+        fused=fuseLeaves(self.intervals.bounds,leaves,[self.combMethod],self.cache,self.nbProcesses,
+                         self.pool)[self.combMethod]
+        hurwicz,maximal=fusionDecisions(fused,self.alpha)
+        return [intervalsProbability(fused[i]) for i in range(len(chunk))],hurwicz,maximal
+
+    def close(self):
+        """Stop the worker processes, if any (they are started again by the next prediction)
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool=None
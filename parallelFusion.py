@@ -0,0 +1,177 @@
+import ctypes
+import multiprocessing
+import multiprocessing.sharedctypes
+import numpy as np
+from intervalsProbability import setOfIntProba, batchIntervalsProbability
+from fusionCache import fusionCache
+
+COMBINATIONS=["almostMCScomb","mostMCSconj","bestfirstMCS","meanfirstMCSweighted"]
+
+# stacks shared with the worker processes, set when they start
+_worker={}
+
+def fuseStacks(stacks,combnames,n=5):
+    """Fuse the probability intervals of several instances, in the current process
+
+    Argument:
+    stacks -- a Nxmx2xn array containing the m probability intervals to fuse for each of N instances
+    combnames -- a list of combination names (see setOfIntProba.runCombinations)
+    n -- number of MCS used by bestfirstMCS and meanfirstMCSweighted
+
+    Return a dictionary giving, for each combination name, the Nx2xn array of fused bounds.
+    """
+    for combname in combnames:
+        if combname not in COMBINATIONS:
+            raise Exception('Unknown combination: %s' % combname)
+    fused=dict((combname,np.zeros((stacks.shape[0],2,stacks.shape[3]))) for combname in combnames)
+    for j in range(stacks.shape[0]):
+        resultingcombs=setOfIntProba(stacks[j]).runCombinations(combnames,n)
+        for combname in combnames:
+            fused[combname][j]=resultingcombs[combname].lproba
+    return fused
+
+def _initWorker(shared,shape,combnames,n):
+    _worker['stacks']=np.frombuffer(shared).reshape(shape)
+    _worker['combnames']=combnames
+    _worker['n']=n
+
+def _fuseChunk(chunk):
+    start,end=chunk
+    return fuseStacks(_worker['stacks'][start:end],_worker['combnames'],_worker['n'])
+
+def parallelFusion(stacks,combnames,n=5,nbProcesses=None,chunksize=None):
+    """Fuse the probability intervals of several instances, instances being split among processes
+
+    Argument:
+    stacks -- a Nxmx2xn array containing the m probability intervals to fuse for each of N instances
+    combnames -- a list of combination names (see setOfIntProba.runCombinations)
+    n -- number of MCS used by bestfirstMCS and meanfirstMCSweighted
+    nbProcesses -- number of worker processes (default: number of cpus, 1: no worker)
+    chunksize -- number of instances sent at once to a worker
+
+    Stacks are copied once in shared memory, so that they are not sent to the workers, and results
+    are gathered in the order of instances: they do not depend on the number of processes.
+
+    Return a dictionary giving, for each combination name, the Nx2xn array of fused bounds.
+    """
+    if stacks.__class__.__name__ != 'ndarray' or stacks.ndim != 4 or stacks.shape[2] != 2:
+        raise Exception('Expecting a Nxmx2xn numpy array as argument')
+    if nbProcesses is None:
+        nbProcesses=multiprocessing.cpu_count()
+    nbInstances=stacks.shape[0]
+    if nbProcesses <= 1 or nbInstances <= 1:
+        return fuseStacks(stacks,combnames,n)
+    if chunksize is None:
+        chunksize=max(1,-(-nbInstances//(4*nbProcesses)))
+    shared=multiprocessing.sharedctypes.RawArray(ctypes.c_double,stacks.size)
+    np.frombuffer(shared).reshape(stacks.shape)[:]=stacks
+    chunks=[(start,min(start+chunksize,nbInstances)) for start in range(0,nbInstances,chunksize)]
+    pool=multiprocessing.Pool(min(nbProcesses,len(chunks)),_initWorker,(shared,stacks.shape,list(combnames),n))
+    try:
+        fusedchunks=pool.map(_fuseChunk,chunks)
+    finally:
+        pool.close()
+        pool.join()
+    return dict((combname,np.concatenate([fusedchunk[combname] for fusedchunk in fusedchunks]))
+                for combname in combnames)
+
+def _fuseStacks(arguments):
+    return fuseStacks(*arguments)
+
+def poolFusion(pool,stacks,combnames,n=5,chunksize=1):
+    """Fuse the probability intervals of several instances with the workers of an existing pool
+
+    Argument:
+    pool -- a multiprocessing.Pool
+    stacks -- a Nxmx2xn array containing the m probability intervals to fuse for each of N instances
+    combnames -- a list of combination names (see setOfIntProba.runCombinations)
+    n -- number of MCS used by bestfirstMCS and meanfirstMCSweighted
+    chunksize -- number of instances sent at once to a worker
+
+    Unlike parallelFusion, no process is started: stacks are sent to the workers with the tasks, which
+    suits small batches of instances fused one after another (e.g. the chunks of a stream).
+
+    Return a dictionary giving, for each combination name, the Nx2xn array of fused bounds.
+    """
+    nbInstances=stacks.shape[0]
+    chunks=[(stacks[start:start+chunksize],list(combnames),n) for start in range(0,nbInstances,chunksize)]
+    fusedchunks=pool.map(_fuseStacks,chunks)
+    return dict((combname,np.concatenate([fusedchunk[combname] for fusedchunk in fusedchunks]))
+                for combname in combnames)
+
+def fusionDecisions(fused,alpha=0.5):
+    """Take the hurwicz and maximal decisions of fused bounds
+
+    Argument:
+    fused -- a Nx2xn array of fused bounds (made reachable in place)
+    alpha -- hurwicz parameter
+
+    Return a tuple (hurwicz, maximal) of the vector of N hurwicz decisions and of the Nxn boolean array of maximal decisions.
+    """
+    resultingbatch=batchIntervalsProbability(fused)
+    return resultingbatch.nc_hurwicz_decision(alpha),resultingbatch.nc_maximal_decision()
+
+def fuseLeaves(bounds,leaves,combMethods,cache,nbProcesses=1,pool=None):
+    """Function that takes the bounds of the nodes of a forest (Lx2xn array, see forestIntervals) and
+    the indices of the leaves reached by N instances (Nxm array), and return a dictionary giving, for
+    each combination name, the Nx2xn array of fused bounds
+
+    With nbProcesses > 1, the leaves not found in cache are fused by parallelFusion, or by the workers
+    of pool if it is given (see poolFusion).
+    """
+    fusedproba=dict((method,np.zeros((leaves.shape[0],2,bounds.shape[2]))) for method in combMethods)
+    # signatures to fuse, with the instances reaching them
+    pending=[]
+    pendinginstances={}
+    for j in range(leaves.shape[0]):
+        signature=tuple(leaves[j])
+        if signature in pendinginstances:
+            pendinginstances[signature].append(j)
+            continue
+        cached=[cache.get((signature,method)) for method in combMethods]
+        if any([resultingcomb is None for resultingcomb in cached]):
+            if nbProcesses > 1:
+                pending.append(signature)
+                pendinginstances[signature]=[j]
+                continue
+            resultingcombs=setOfIntProba(bounds[leaves[j]]).runCombinations(combMethods)
+            cached=[resultingcombs[method].lproba for method in combMethods]
+            for method,resultingcomb in zip(combMethods,cached):
+                cache.put((signature,method),resultingcomb)
+        for method,resultingcomb in zip(combMethods,cached):
+            fusedproba[method][j]=resultingcomb
+    if len(pending) > 0:
+        stacks=bounds[np.array(pending)]
+        if pool is None:
+            fused=parallelFusion(stacks,combMethods,nbProcesses=nbProcesses)
+        else:
+            fused=poolFusion(pool,stacks,combMethods,chunksize=max(1,-(-len(pending)//(4*nbProcesses))))
+        for p in range(len(pending)):
+            for method in combMethods:
+                cache.put((pending[p],method),fused[method][p])
+                fusedproba[method][pendinginstances[pending[p]]]=fused[method][p]
+            # other instances reaching the same leaves are looked up, as when fusing serially
+            for j in pendinginstances[pending[p]][1:]:
+                for method in combMethods:
+                    cache.get((pending[p],method))
+    return fusedproba
+
+def fusionAccuracies(fusedproba,true_class):
+    """Function that takes fused bounds (Nx2xn array) and true classes (Nxn 0/1 array) of test instances
+    and return the accuracy of hurwicz decisions, and the set and discounted accuracies of maximal decisions
+    """
+    # decisions are taken on all test instances at once
+    resultingbatch=batchIntervalsProbability(fusedproba)
+    decision=resultingbatch.nc_hurwicz_decision(0.5)
+    accuracy=true_class[np.arange(true_class.shape[0]),decision].sum()
+
+    decision_max=resultingbatch.nc_maximal_decision()
+    correct_set=np.any(decision_max & (true_class==1),axis=1)
+    set_accuracy=float(correct_set.sum())
+    disc_accuracy=(1./decision_max[correct_set].sum(axis=1)).sum()
+
+    accuracy=accuracy/true_class.shape[0]
+    set_accuracy=set_accuracy/true_class.shape[0]
+    disc_accuracy=disc_accuracy/true_class.shape[0]
+    
+    return accuracy, set_accuracy, disc_accuracy
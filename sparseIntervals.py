@@ -0,0 +1,297 @@
+import numpy as np
+from intervalsProbability import setOfIntProba
+
+class sparseIntervalsProbability:
+    """Class of probability intervals over a large frame, most elements sharing the same (default) bounds
+
+    Argument:
+    indices -- a vector of the k (sorted, distinct) elements having their own bounds
+    lproba -- a 2xk array containing upper (1st row) and lower (2nd row) bounds of these elements
+    default -- a vector (upper, lower) of the bounds shared by the n-k other elements
+    nbDecision -- size n of the frame
+
+    Only the k explicit bounds are stored, and all computations take O(k) time. Events are given
+    as vectors of (distinct) elements, and decisions are the same as with the dense bounds (see
+    toDense and intervalsProbability).
+    """
+
+    def __init__(self,indices,lproba,default,nbDecision):
+        if lproba.__class__.__name__ != 'ndarray':
+            raise Exception('Expecting a numpy array as argument')
+        indices=np.asarray(indices,dtype=int)
+        default=np.asarray(default,dtype=float)
+        if lproba.ndim != 2 or lproba.shape[0] != 2 or lproba.shape[1] != indices.size:
+            raise Exception('Array should contain two rows (upper and lower bounds) and one column per index')
+        if np.any(np.diff(indices) <= 0) or (indices.size > 0 and (indices[0] < 0 or indices[-1] >= nbDecision)):
+            raise Exception('Indices should be sorted, distinct elements of the frame')
+        if default.shape != (2,):
+            raise Exception('Default should contain an upper and a lower bound')
+        if np.all(lproba[0] >= lproba[1]) != 1 or default[0] < default[1]:
+            raise Exception('Some upper bounds lower than lower bounds')
+        self.indices=indices
+        self.lproba=lproba
+        self.default=default
+        self.nbDecision=nbDecision
+        self.nbDefault=nbDecision-indices.size
+
+    def toDense(self):
+        """Return the 2xn array of the bounds of all the elements
+        """
+        lproba=np.empty((2,self.nbDecision))
+        lproba[:,:]=self.default[:,np.newaxis]
+        lproba[:,self.indices]=self.lproba
+        return lproba
+
+    def _sums(self):
+        """Internal function returning the sums (upper, lower) of the bounds over all the elements.
+        """
+        return self.lproba[0].sum()+self.nbDefault*self.default[0],self.lproba[1].sum()+self.nbDefault*self.default[1]
+
+    def _firstDefault(self):
+        """Internal function returning the first element with default bounds (None if there is none).
+        """
+        if self.nbDefault == 0:
+            return None
+        # the first element whose index differs from its rank among explicit elements
+        gaps=np.flatnonzero(self.indices != np.arange(self.indices.size))
+        return gaps[0] if gaps.size > 0 else self.indices.size
+
+    def isProper(self):
+        """Check if probability intervals induce a non-empty probability set.
+
+        Return 0 (empty) or 1 (non-empty).
+        """
+        upsum,lowsum=self._sums()
+        if lowsum <= 1 and upsum >= 1:
+            return 1
+        return 0
+
+    def isReachable(self):
+        """Check if the probability intervals are reachable
+
+        Return a 0/1 value (1: are reachable).
+        """
+        upsum,lowsum=self._sums()
+        upper=np.append(self.lproba[0],self.default[0])
+        lower=np.append(self.lproba[1],self.default[1])
+        if self.nbDefault == 0:
+            upper,lower=upper[:-1],lower[:-1]
+        if np.any(upper+(lowsum-lower) > 1.0) or np.any(lower+(upsum-upper) < 1.0):
+            return 0
+        return 1
+
+    def setReachableProbability(self):
+        """Make the bounds reachable (explicit and default ones).
+        """
+        if self.isProper() == 0:
+            raise Exception('intervals inducing empty set: operation not possible')
+        upsum,lowsum=self._sums()
+        lproba=np.zeros((2,self.indices.size))
+        lproba[1]=np.maximum(self.lproba[1],1-(upsum-self.lproba[0]))
+        lproba[0]=np.minimum(self.lproba[0],1-(lowsum-self.lproba[1]))
+        if self.nbDefault > 0:
+            self.default=np.array([min(self.default[0],1-(lowsum-self.default[1])),
+                                   max(self.default[1],1-(upsum-self.default[0]))])
+        self.lproba=lproba
+
+    def getEventsProbability(self,events):
+        """Compute upper and lower probabilities of several events
+
+        Argument:
+        events -- a list of k vectors, each one containing the (distinct) elements of an event
+
+        Return a 2xk array containing upper (1st row) and lower (2nd row) probabilities of the events.
+        """
+        if self.isReachable() == 0:
+            self.setReachableProbability()
+        upsum,lowsum=self._sums()
+        eventsProbability=np.zeros((2,len(events)))
+        for e in range(len(events)):
+            event=np.asarray(events[e],dtype=int)
+            if event.size > 0 and (event.min() < 0 or event.max() >= self.nbDecision or np.unique(event).size != event.size):
+                raise Exception('Subset incompatible with the frame size')
+            explicit=np.in1d(self.indices,event)
+            nbdefault=event.size-explicit.sum()
+            inupper=self.lproba[0,explicit].sum()+nbdefault*self.default[0]
+            inlower=self.lproba[1,explicit].sum()+nbdefault*self.default[1]
+            eventsProbability[0,e]=min(inupper,1-(lowsum-inlower))
+            eventsProbability[1,e]=max(inlower,1-(upsum-inupper))
+        return eventsProbability
+
+    def getLowerProbability(self,event):
+        """Compute the lower probability of an event, given as a vector of its (distinct) elements
+        """
+        return self.getEventsProbability([event])[1,0]
+
+    def getUpperProbability(self,event):
+        """Compute the upper probability of an event, given as a vector of its (distinct) elements
+        """
+        return self.getEventsProbability([event])[0,0]
+
+    def _argmax(self,values,defaultvalue):
+        """Internal function returning the first element of highest value, given the values of explicit
+        elements and the value of default ones.
+        """
+        best=None
+        if values.size > 0:
+            k=values.argmax()
+            best,bestvalue=self.indices[k],values[k]
+        first=self._firstDefault()
+        if first is not None and (best is None or defaultvalue > bestvalue or (defaultvalue == bestvalue and first < best)):
+            best=first
+        return best
+
+    def nc_maximin_decision(self):
+        """Return the maximin classification decision (nc: no costs)
+        """
+        if self.isReachable() == 0:
+            self.setReachableProbability()
+        return self._argmax(self.lproba[1],self.default[1])
+
+    def nc_maximax_decision(self):
+        """Return the maximax classification decision (nc: no costs)
+        """
+        if self.isReachable() == 0:
+            self.setReachableProbability()
+        return self._argmax(self.lproba[0],self.default[0])
+
+    def nc_hurwicz_decision(self,alpha):
+        """Return the hurwicz classification decision (nc: no costs)
+        """
+        if self.isReachable() == 0:
+            self.setReachableProbability()
+        return self._argmax(alpha*self.lproba[0]+(1-alpha)*self.lproba[1],alpha*self.default[0]+(1-alpha)*self.default[1])
+
+    def nc_maximal_decision(self):
+        """Return the classification decisions that are maximal (nc: no costs)
+
+        Return a vector of n booleans (True for maximal decisions).
+        """
+        if self.isReachable() == 0:
+            self.setReachableProbability()
+        best=self._argmax(self.lproba[1],self.default[1])
+        explicit=np.searchsorted(self.indices,best)
+        isexplicit=explicit < self.indices.size and self.indices[explicit] == best
+        # highest lower bound of the other elements than best, the default one counting nbDefault times
+        others=np.delete(self.lproba[1],explicit) if isexplicit else self.lproba[1]
+        nbdefault=self.nbDefault if isexplicit else self.nbDefault-1
+        second=max(others.max() if others.size > 0 else -np.inf,self.default[1] if nbdefault > 0 else -np.inf)
+        bestlower=self.lproba[1,explicit] if isexplicit else self.default[1]
+        maximal=np.empty(self.nbDecision,dtype=bool)
+        maximal[:]=self.default[0] >= bestlower
+        maximal[self.indices]=self.lproba[0] >= bestlower
+        maximal[best]=(self.lproba[0,explicit] if isexplicit else self.default[0]) >= second
+        return maximal
+
+def sparseIntervalsFromDense(lproba):
+    """Return the sparseIntervalsProbability of a 2xn array of bounds, the default bounds being the most frequent ones
+    """
+    pairs,inverse,counts=np.unique(lproba.transpose(),axis=0,return_inverse=True,return_counts=True)
+    indices=np.flatnonzero(inverse != counts.argmax())
+    return sparseIntervalsProbability(indices,lproba[:,indices].copy(),pairs[counts.argmax()],lproba.shape[1])
+
+def sparseIntervalsFromCounts(indices,counts,nbDecision,s=4):
+    """Return the imprecise Dirichlet intervals of class counts, without building dense bounds
+
+    Argument:
+    indices -- a vector of the (sorted, distinct) classes having non-zero counts
+    counts -- a vector of their counts
+    nbDecision -- number of classes
+    s -- parameter of the imprecise Dirichlet model
+
+    Classes with zero counts share the default bounds (s/(N+s), 0), N being the total count.
+    """
+    counts=np.asarray(counts,dtype=float)
+    divide=counts.sum()+s
+    return sparseIntervalsProbability(indices,np.array([(counts+s)/divide,counts/divide]),[s/divide,0.],nbDecision)
+
+class sparseSetOfIntProba:
+    """Class to handle sets of sparse probability intervals
+
+    Argument:
+    sources -- a list of m sparseIntervalsProbability over the same frame
+    stats, maximal -- see setOfIntProba
+
+    Elements that are explicit in none of the sources have default bounds in all of them: they are
+    merged in a single column of bounds, counted as many times as they are elements. Combinations
+    are done by a setOfIntProba over the u explicit elements and this column (mx2x(u+1) bounds),
+    the column being placed at the rank of the first of these elements, so that elements are split
+    in the same order as with dense bounds. Results are sparseIntervalsProbability.
+    """
+
+    def __init__(self,sources,stats=None,maximal=False):
+        if len(sources) == 0:
+            raise Exception('Expecting at least one source')
+        self.nbDecision=sources[0].nbDecision
+        if any([source.nbDecision != self.nbDecision for source in sources]):
+            raise Exception('Sources should be defined on the same frame')
+        self.nbProbInt=len(sources)
+        self.union=np.unique(np.concatenate([source.indices for source in sources]))
+        nbRest=self.nbDecision-self.union.size
+        self.explicitColumns=np.arange(self.union.size)
+        self.restColumn=None
+        weights=None
+        if nbRest > 0:
+            gaps=np.flatnonzero(self.union != np.arange(self.union.size))
+            self.restColumn=gaps[0] if gaps.size > 0 else self.union.size
+            self.explicitColumns[self.restColumn:]+=1
+            weights=np.ones(self.union.size+1)
+            weights[self.restColumn]=nbRest
+        reduced=np.zeros((self.nbProbInt,2,self.explicitColumns.size+(nbRest > 0)))
+        for i in range(self.nbProbInt):
+            reduced[i,:,:]=sources[i].default[:,np.newaxis]
+            reduced[i][:,self.explicitColumns[np.searchsorted(self.union,sources[i].indices)]]=sources[i].lproba
+        self.reducedSet=setOfIntProba(reduced,stats,weights=weights,maximal=maximal)
+
+    def toDense(self):
+        """Return the mx2xn array of the bounds of all the elements
+        """
+        intlist=np.empty((self.nbProbInt,2,self.nbDecision))
+        if self.restColumn is not None:
+            intlist[:,:,:]=self.reducedSet.intlist[:,:,self.restColumn,np.newaxis]
+        intlist[:,:,self.union]=self.reducedSet.intlist[:,:,self.explicitColumns]
+        return intlist
+
+    def _fromReduced(self,result):
+        """Internal function turning an intervalsProbability over the reduced columns into a
+        sparseIntervalsProbability.
+        """
+        default=[1.,0.] if self.restColumn is None else result.lproba[:,self.restColumn]
+        return sparseIntervalsProbability(self.union,result.lproba[:,self.explicitColumns],default,self.nbDecision)
+
+    def areCompatible(self):
+        """Check whether the set of probability intervals are compatible, i.e., if the conjunction is non-empty.
+
+        Return 1 if non-empty, 0 if empty
+        """
+        return self.reducedSet.areCompatible()
+
+    def conjunction(self):
+        """Perform a conjunctive merging of the set of probability intervals
+
+        Return a sparseIntervalsProbability.
+        """
+        return self._fromReduced(self.reducedSet.conjunction())
+
+    def disjunction(self):
+        """Perform a disjunctive merging of the set of probability intervals
+
+        Return a sparseIntervalsProbability.
+        """
+        return self._fromReduced(self.reducedSet.disjunction())
+
+    def getalmostMCS(self):
+        """Return the 'almost' MCS of the probability intervals (see setOfIntProba.getalmostMCS)
+        """
+        return self.reducedSet.getalmostMCS()
+
+    def runCombinations(self, combnames, n=5):
+        """Perform several combinations (see setOfIntProba.runCombinations)
+
+        Return a dictionary giving the resulting sparseIntervalsProbability of each (known) combination name.
+        """
+        results=self.reducedSet.runCombinations(combnames,n)
+        return dict((combname,self._fromReduced(result)) for combname,result in results.items())
+
+    def runCombination(self, combname, n=5):
+        return self.runCombinations([combname],n).get(combname,[])